@@ -1,12 +1,39 @@
 
 # OBDD
 
-import math
-
 # This is for the 'reduce' function.
 
 from functools import reduce
 
+# Ordered dictionaries are used for the LRU and FIFO computed tables.
+
+from collections import OrderedDict
+
+# Typed arrays for the columns of the node store.
+
+from array import array
+
+# Priority queue for the smallest-first chain conjunction and disjunction.
+
+import heapq
+
+# Object sizes for reporting the memory reclaimed by garbage collection.
+
+import sys
+
+# Random number generator for sampling models.
+
+import random
+
+# Binary files of OBDDs, which are read through memory maps.
+
+import struct
+import mmap
+
+# Timing of operations for the statistics.
+
+import time
+
 # Truth-tables for commonly used binary connectives
 
 def AND(b1,b2):
@@ -39,39 +66,208 @@ def IMPL(b1,b2):
     else:
         return 0
 
-# Type of non-terminal OBDD nodes
-#    nodeVar : the variable in the node
-#    posChild : the sub-OBDD when nodeVar is true
-#    negChild : the sub-OBDD when nodeVar is false
+# Computed table (operation cache) for the APPLY operation.
 #
-# The two terminal nodes are represented by the integers 0 and 1,
-# with the usual meaning of 0 being FALSE and 1 being TRUE.
+# Entries are keyed by (operator, node-id, node-id), and map to the
+# result of applying the operator to the two nodes. The table holds
+# at most 'capacity' entries. When it is full, an entry is evicted
+# according to 'policy':
+#    "lru"    : evict the least recently used entry
+#    "fifo"   : evict the entry that was inserted first
+#    "direct" : direct-mapped table: each key has exactly one slot,
+#               and a new entry overwrites the old one in its slot
+#    "clear"  : empty the whole table
+#
+# 'hits' and 'misses' count the lookups, and 'evictions' the entries
+# that were thrown out to make room for new ones.
+
+class ComputedTable():
+    def __init__(self,capacity=1 << 18,policy="lru"):
+        if capacity < 1:
+            raise ValueError("computed table capacity must be positive")
+        if policy not in ("lru","fifo","direct","clear"):
+            raise ValueError("unknown eviction policy: " + str(policy))
+        self.capacity = capacity
+        self.policy = policy
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.clear()
+
+    # Remove all entries (the counters are kept).
+
+    def clear(self):
+        if self.policy == "direct":
+            self.slots = [None] * self.capacity
+            self.size = 0
+        elif self.policy == "clear":
+            self.table = dict()
+        else:
+            self.table = OrderedDict()
+
+    def __len__(self):
+        if self.policy == "direct":
+            return self.size
+        return len(self.table)
+
+    # Return the cached result for 'key', or None if there is none.
+
+    def lookup(self,key):
+        if self.policy == "direct":
+            entry = self.slots[hash(key) % self.capacity]
+            if entry is not None and entry[0] == key:
+                self.hits += 1
+                return entry[1]
+            self.misses += 1
+            return None
+        result = self.table.get(key)
+        if result is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        if self.policy == "lru":
+            self.table.move_to_end(key)
+        return result
+
+    # Store the result for 'key', evicting an entry if the table is full.
+
+    def insert(self,key,result):
+        if self.policy == "direct":
+            slot = hash(key) % self.capacity
+            if self.slots[slot] is None:
+                self.size += 1
+            else:
+                self.evictions += 1
+            self.slots[slot] = (key,result)
+            return
+        if key not in self.table and len(self.table) >= self.capacity:
+            if self.policy == "clear":
+                self.evictions += len(self.table)
+                self.table.clear()
+            else:
+                self.table.popitem(last=False)
+                self.evictions += 1
+        self.table[key] = result
+
+    # Remove the entries for which stale(key,result) is true.
+
+    def purge(self,stale):
+        if self.policy == "direct":
+            for slot,entry in enumerate(self.slots):
+                if entry is not None and stale(entry[0],entry[1]):
+                    self.slots[slot] = None
+                    self.size -= 1
+            return
+        for key in [ key for key,result in self.table.items() if stale(key,result) ]:
+            del self.table[key]
+
+    # Fraction of lookups that found a cached result.
+
+    def hitRate(self):
+        lookups = self.hits + self.misses
+        if lookups == 0:
+            return 0.0
+        return self.hits / lookups
+
+# External reference to the OBDD 'node' in the OBDD manager 'bdd',
+# which is removed when the handle is deleted.
+
+class OBDDhandle():
+    def __init__(self,bdd,node):
+        self.bdd = bdd
+        self.node = bdd.ref(node)
 
-class OBDDnode():
-    def __init__(self,nodeVar,posChild,negChild):
-        self.nodeVar = nodeVar
-        self.posChild = posChild
-        self.negChild = negChild
-        self.modelCount = 0
+    def __del__(self):
+        self.bdd.deref(self.node)
 
 # Class for an OBDD with a given variable ordering, and with
 # each subgraph induced by a node representing a Boolean function.
+#
+# OBDD nodes are integers, which index the columns of the node store:
+#    nodeVar[n] : the index of the variable in node n
+#    posChild[n] : the sub-OBDD when the variable is true
+#    negChild[n] : the sub-OBDD when the variable is false
+#    modelCount[n] : the model-count of node n
+#
+# OBDDs use complement edges. An OBDD b is a reference b = 2*n+c
+# to node n, where c=1 means that the reference is complemented,
+# that is, b represents the negation of the function of node n.
+# Negation is therefore b^1, and b and its negation share all nodes.
+#
+# There is a single terminal node 0, which represents FALSE. The
+# references 0 and 1 are FALSE and TRUE, as before. The variable
+# index of the terminal node is the number of variables, that is,
+# it comes after all variables in the ordering.
+#
+# To keep the representation canonical, the negChild of a node
+# is never complemented.
+#
+# The variable ordering can be changed by reorder(), which sifts the
+# variables to better positions by swapping adjacent variables in
+# place. Swapping changes the nodes at the two swapped indices, but
+# every OBDD keeps representing the same Boolean function, so OBDDs
+# created before reordering stay valid.
+#
+# Nodes that are no longer needed can be freed by collect(). The OBDDs
+# that must survive garbage collection are referenced externally, with
+# ref(b) and deref(b), or by keeping an OBDDhandle. With 'gcThreshold'
+# set, collection is automatic, and then OBDDs that are not referenced
+# may be freed at the start of any later APPLY (except its operands).
+# Without 'gcThreshold', nothing is freed unless collect() is called.
 
 class OBDD():
 
     # Initialize an OBDD with a given variable ordering.
 
-    def __init__(self,vars):
+    def __init__(self,vars,cacheSize=1 << 18,cachePolicy="lru",reorderThreshold=None,maxGrowth=1.2,gcThreshold=None):
 
         # 'vars' is a list of variable names (strings), indicating
-        # the variable ordering of the OBDD.
+        # the variable ordering of the OBDD. It is copied, because
+        # reordering changes it.
+
+        self.vars = list(vars)
+
+        # 'hash' has a dictionary for each variable index var, for
+        # mapping child1, child2 to the unique OBDD node with var,
+        # child1 and child2.
+
+        self.hash = [ dict() for v in vars ]
 
-        self.vars = vars
+        # Number of nodes in 'hash'
 
-        # 'hash' is a dictionary for mapping var, child1, child2 to
-        # the unique OBDD node with these properties.
+        self.liveNodes = 0
 
-        self.hash = dict()
+        # The node store. The variable index and the children of a node
+        # are in typed arrays, so that a node takes a few machine words
+        # instead of a Python object. The model-counts are Python
+        # integers, because they do not fit in machine words for more
+        # than 63 variables. modelCount[n] is the number of models
+        # of node n over the variables from nodeVar[n] onwards.
+
+        self.nodeVar = array('i',[len(vars)])
+        self.posChild = array('q',[0])
+        self.negChild = array('q',[0])
+        self.modelCount = [0]
+
+        # nodeRefs[n] is the number of nodes that have n as a child,
+        # and extRefs[n] the number of external references to n
+        # (see ref). 'freeNodes' are the indices of freed nodes,
+        # which are reused for new nodes.
+
+        self.nodeRefs = array('i',[0])
+        self.extRefs = array('i',[0])
+        self.freeNodes = []
+
+        # 'cache' is the computed table for the APPLY operation.
+        # 'cacheSize' bounds its number of entries, and 'cachePolicy'
+        # is its eviction policy (see ComputedTable).
+
+        self.cache = ComputedTable(cacheSize,cachePolicy)
+
+        # Properties of the Boolean functions given to APPLY
+        # (see operatorKind).
+
+        self.opKinds = dict()
 
         # 'varIndex' is a mapping from variables to their indices.
 
@@ -79,80 +275,498 @@ class OBDD():
         for i in range(0,len(vars)):
             self.varIndex[vars[i]] = i
 
+        # Literal weights for weighted model-counting (see setWeights).
+
+        self.setWeights(dict())
+
+        # Dynamic reordering. When 'reorderThreshold' is not None,
+        # the variables are reordered automatically when an APPLY
+        # starts with at least 'reorderThreshold' nodes, and the
+        # threshold is then raised to twice the number of nodes.
+        # Sifting does not move a variable further in a direction
+        # once the number of nodes exceeds 'maxGrowth' times the
+        # smallest number seen so far.
+
+        self.reorderThreshold = reorderThreshold
+        self.maxGrowth = maxGrowth
+
+        # Nodes below 'pinned' are not freed during reordering, and
+        # 'busy' is nonzero during operations that must not be
+        # interrupted by reordering or garbage collection.
+
+        self.pinned = 0
+        self.busy = 0
+
+        # Garbage collection. When 'gcThreshold' is not None, the dead
+        # nodes, which are not reachable from external references, are
+        # collected at the start of an APPLY when they are more than
+        # the fraction 'gcThreshold' of all nodes, and there are at
+        # least 'gcMinNodes' nodes. Totals of the collections so far
+        # are in 'gcRuns', 'freedNodes' and 'reclaimedBytes'.
+
+        self.gcThreshold = gcThreshold
+        self.gcMinNodes = 1024
+        self.gcRuns = 0
+        self.freedNodes = 0
+        self.reclaimedBytes = 0
+
+        # 'liveRefs' is for telling the live and dead nodes apart (see
+        # addLiveRef). With automatic garbage collection it is kept up
+        # to date all the time, and otherwise only during reordering.
+
+        self.liveCount = 0
+        if gcThreshold is None:
+            self.liveRefs = None
+        else:
+            self.liveRefs = array('i',[0])
+
+        # Instrumentation (see stats). 'opCalls' maps the names of the
+        # operators of APPLY, and of the other operations, to the
+        # number of times they have been called. If 'timer' is not
+        # None, timer(op,seconds) is called after every operation that
+        # is not part of another one.
+
+        self.opCalls = dict()
+        self.timer = None
+
     # Create a new node if one does not already exist.
     # Must check that child1 and child2 are different:
     # if they are the same, return the child directly,
     # without creating a new node. This is the property
     # of being 'reduced'.
+    #
+    # If child2 is complemented, the node for the negated
+    # children is created instead, and a complemented
+    # reference to it is returned.
 
     def newOBDDnode(self,rootVar,child1,child2):
         if child1 == child2:
             return child1
-        if (rootVar,child1,child2) in self.hash:
-            return self.hash[(rootVar,child1,child2)]
-        newNode = OBDDnode(rootVar,child1,child2)
-        self.hash[(rootVar,child1,child2)] = newNode
+        c = child2 & 1
+        child1 ^= c
+        child2 ^= c
+        unique = self.hash[rootVar]
+        if (child1,child2) in unique:
+            return (unique[(child1,child2)] << 1) | c
+        if self.freeNodes:
+            newNode = self.freeNodes.pop()
+            self.nodeVar[newNode] = rootVar
+            self.posChild[newNode] = child1
+            self.negChild[newNode] = child2
+            self.nodeRefs[newNode] = 0
+            self.extRefs[newNode] = 0
+            if self.liveRefs is not None:
+                self.liveRefs[newNode] = 0
+        else:
+            newNode = len(self.nodeVar)
+            self.nodeVar.append(rootVar)
+            self.posChild.append(child1)
+            self.negChild.append(child2)
+            self.modelCount.append(0)
+            self.nodeRefs.append(0)
+            self.extRefs.append(0)
+            if self.liveRefs is not None:
+                self.liveRefs.append(0)
+        self.nodeRefs[child1 >> 1] += 1
+        self.nodeRefs[child2 >> 1] += 1
+        unique[(child1,child2)] = newNode
+        self.liveNodes += 1
+        self.updateCount(newNode)
+        return (newNode << 1) | c
 
-        # Do model-count
+    # Do model-count. The variables skipped between the node
+    # and its children can have any value.
 
-        count1 = 0
-        count2 = 0
-        
-        #INSET CODE HERE
+    def updateCount(self,node):
+        var = self.nodeVar[node]
+        count1 = self.countFrom(self.posChild[node],var+1)
+        count2 = self.countFrom(self.negChild[node],var+1)
 
         # Store model-count
 
-        newNode.modelCount = count1 + count2
+        self.modelCount[node] = count1 + count2
+
+    # Index of the root variable of an OBDD.
 
-        return newNode
+    def rootVar(self,b):
+        return self.nodeVar[b >> 1]
+
+    # The sub-OBDDs of b when the variable with index 'var' is true
+    # and false. 'var' must not come after the root variable of b.
+
+    def cofactors(self,b,var):
+        node = b >> 1
+        if self.nodeVar[node] != var:
+            return b,b
+        c = b & 1
+        return self.posChild[node] ^ c,self.negChild[node] ^ c
+
+    # Properties of a Boolean function f for APPLY, as a pair:
+    #    linear : f(b1,b2) is b1 XOR b2, or its negation
+    #    commutative : f(b1,b2) = f(b2,b1)
+
+    def operatorKind(self,f):
+        kind = self.opKinds.get(f)
+        if kind is None:
+            t00,t01,t10,t11 = f(0,0),f(0,1),f(1,0),f(1,1)
+            kind = (t00 != t01 and t00 != t10 and t01 != t11,t01 == t10)
+            self.opKinds[f] = kind
+        return kind
+
+    # The result of APPLY when it does not depend on the structure of
+    # b1 and b2: when either one of them is a terminal, or when they
+    # are equal or each other's negation. Otherwise return None.
+
+    def terminalCase(self,f,b1,b2):
+
+        # Function of b that is t0 when b is false and t1 when b is true.
+
+        def lift(t0,t1,b):
+            if t0 == t1:
+                return t0
+            if t1 == 1:
+                return b
+            return b ^ 1
+
+        if b1 < 2:
+            return lift(f(b1,0),f(b1,1),b2)
+        if b2 < 2:
+            return lift(f(0,b2),f(1,b2),b1)
+        if b1 == b2:
+            return lift(f(0,0),f(1,1),b1)
+        if b1 == b2 ^ 1:
+            return lift(f(0,1),f(1,0),b1)
+        return None
 
     # The APPLY operation for two OBDD nodes.
     # 'f' is the Boolean function to be applied at
     # leaf nodes.
+    #
+    # This computes the same as applyRecursive, but with an explicit
+    # stack instead of recursive calls, so that the number of variables
+    # is not limited by the Python recursion limit. The stack has two
+    # kinds of entries:
+    #    (b1,b2) : compute APPLY for b1 and b2
+    #    (rootVar,key,flip) : both children have been computed, and
+    #                         are on top of the 'results' stack;
+    #                         make the node for rootVar from them
+    # After f is found to be XOR or EQVI, the operands are complemented
+    # as needed, and XOR is applied in all of the subproblems.
 
     def apply(self,f,b1,b2):
-        if isinstance(b1,int) and isinstance(b2,int):
-            return f(b1,b2)
-        if isinstance(b1,int) and isinstance(b2,OBDDnode):
-            return self.newOBDDnode(b2.nodeVar,
-                                    self.apply(f,b1,b2.posChild),
-                                    self.apply(f,b1,b2.negChild))
-        elif isinstance(b1,OBDDnode) and isinstance(b2,int):
-            return self.newOBDDnode(b1.nodeVar,
-                                    self.apply(f,b1.posChild,b2),
-                                    self.apply(f,b1.negChild,b2))
-        else:
-            root1 = b1.nodeVar
-            root2 = b2.nodeVar
-
-            if root1==root2:
-                return self.newOBDDnode(root1,
-                                     self.apply(f,b1.posChild,b2.posChild),
-                                     self.apply(f,b1.negChild,b2.negChild))
-
-            if self.varIndex[root1] < self.varIndex[root2]:
-                rootVar = root1
-                child1 = self.apply(f,b1.posChild,b2)
-                child2 = self.apply(f,b1.negChild,b2)
-            else:
-                rootVar = root2
-                child1 = self.apply(f,b1,b2.posChild)
-                child2 = self.apply(f,b1,b2.negChild)
+        self.checkpoint(b1,b2)
+        return self.operation(f.__name__,lambda : self.applyLoop(f,[(b1,b2)])[0])
+
+    # APPLY for a list of pairs of OBDDs, returning the list of the
+    # results. All pairs are computed in one traversal, with a common
+    # stack and computed table, so that the parts shared by the pairs
+    # are computed only once. This is faster than calling apply for
+    # each pair, as it is done as one operation.
 
-            return self.newOBDDnode(rootVar,child1,child2)
+    def apply_many(self,f,pairs):
+        pairs = list(pairs)
+        self.checkpoint(*[ b for pair in pairs for b in pair ])
+        return self.operation(f.__name__,lambda : self.applyLoop(f,pairs))
+
+    def applyLoop(self,f,pairs):
+        linear,commutative = self.operatorKind(f)
+        topflip = 0
+        if linear:
+            topflip = f(0,0)
+            f = XOR
+        cache = self.cache
+        results = []
+        stack = list(reversed(pairs))
+        while stack:
+            task = stack.pop()
+            if len(task) == 3:
+                rootVar,key,flip = task
+                child2 = results.pop()
+                child1 = results.pop()
+                result = self.newOBDDnode(rootVar,child1,child2)
+                cache.insert(key,result)
+                results.append(result ^ flip)
+                continue
+            b1,b2 = task
+            result = self.terminalCase(f,b1,b2)
+            if result is not None:
+                results.append(result)
+                continue
+            flip = 0
+            if linear:
+                flip = (b1 ^ b2) & 1
+                b1 = b1 & ~1
+                b2 = b2 & ~1
+            if commutative and b1 > b2:
+                b1,b2 = b2,b1
+            key = (f,b1,b2)
+            result = cache.lookup(key)
+            if result is not None:
+                results.append(result ^ flip)
+                continue
+            rootVar = min(self.rootVar(b1),self.rootVar(b2))
+            pos1,neg1 = self.cofactors(b1,rootVar)
+            pos2,neg2 = self.cofactors(b2,rootVar)
+            stack.append((rootVar,key,flip))
+            stack.append((neg1,neg2))
+            stack.append((pos1,pos2))
+        return [ result ^ topflip for result in results ]
+
+    # The APPLY operation for two OBDD nodes, as a recursive function.
+    # 'f' is the Boolean function to be applied at
+    # leaf nodes.
+    #
+    # Results are memoized in the computed table, so that every pair
+    # of nodes of b1 and b2 is visited at most once (as long as the
+    # entries are not evicted), and APPLY runs in O(|b1|*|b2|) time.
+    # XOR and EQVI are computed from the uncomplemented operands, so
+    # that they share their cache entries for b1, b2 and their negations.
+
+    def applyRecursive(self,f,b1,b2):
+        result = self.terminalCase(f,b1,b2)
+        if result is not None:
+            return result
+        linear,commutative = self.operatorKind(f)
+        flip = 0
+        if linear:
+            flip = ((b1 ^ b2) & 1) ^ f(0,0)
+            f = XOR
+            b1 = b1 & ~1
+            b2 = b2 & ~1
+        if commutative and b1 > b2:
+            b1,b2 = b2,b1
+        key = (f,b1,b2)
+        result = self.cache.lookup(key)
+        if result is not None:
+            return result ^ flip
+        rootVar = min(self.rootVar(b1),self.rootVar(b2))
+        pos1,neg1 = self.cofactors(b1,rootVar)
+        pos2,neg2 = self.cofactors(b2,rootVar)
+        child1 = self.applyRecursive(f,pos1,pos2)
+        child2 = self.applyRecursive(f,neg1,neg2)
+        result = self.newOBDDnode(rootVar,child1,child2)
+        self.cache.insert(key,result)
+        return result ^ flip
+
+    # Number of models of b over the variables from index 'var'
+    # onwards. 'var' must not come after the root variable of b.
+    # The count is exact: it is computed with integer shifts.
+
+    def countFrom(self,b,var):
+        node = b >> 1
+        level = self.nodeVar[node]
+        count = self.modelCount[node]
+        if b & 1:
+            count = (1 << (len(self.vars) - level)) - count
+        return count << (level - var)
 
     # Return the model-count of a BDD node, taking into account variables
     # before the root node in the variable ordering.
 
     def countModels(self,b):
-        return b.modelCount * round(math.pow(2, self.varIndex[b.nodeVar]))
+        return self.countFrom(b,0)
+
+    # Model-counts of b under many partial assignments at once.
+    #
+    # 'assumptions' is a matrix (NumPy array of int8) with one row per
+    # query and one column per variable, in the order of 'vars' (by
+    # default the current variable ordering). The entry is 1 if the
+    # variable is assumed true, -1 if it is assumed false, and 0 if it
+    # is free, and other entries are errors. Variables without a
+    # column are free. A single query
+    # can also be given as a vector, which is taken as a matrix with
+    # one row. Returns the array of the numbers of models of b that
+    # agree with each row.
+    #
+    # The nodes of b are visited once, level by level from the bottom,
+    # and the counts of all nodes of a level are computed for all the
+    # queries with array operations. The count of a complemented edge
+    # is the number of assignments to the free variables below it
+    # minus the count of its node. The counts are exact: they are
+    # 64-bit integers if there are fewer than 63 variables, and Python
+    # integers otherwise.
+    #
+    # NumPy is only needed for this, so it is imported here.
+
+    def countModelsBatch(self,b,assumptions,vars=None):
+        import numpy
+        if vars is None:
+            vars = self.vars
+        A = numpy.atleast_2d(numpy.asarray(assumptions))
+        if A.ndim != 2 or A.shape[1] != len(vars):
+            raise ValueError("assumptions must have one column for each of the " + str(len(vars)) + " variables")
+        if not numpy.isin(A,[-1,0,1]).all():
+            raise ValueError("assumptions must be -1, 0 or 1")
+        A = A.astype(numpy.int8)
+        n = len(self.vars)
+        queries = A.shape[0]
+        dtype = numpy.int64 if n < 63 else object
+        values = numpy.zeros((n,queries),dtype=numpy.int8)
+        for j,v in enumerate(vars):
+            values[self.varIndex[v]] = A[:,j]
+        # free[l] is the number of assignments to the free variables
+        # at levels l..n-1, for each query.
+        free = numpy.ones((n+1,queries),dtype=dtype)
+        for l in range(n-1,-1,-1):
+            free[l] = free[l+1] * numpy.where(values[l] == 0,2,1)
+        nodes = self.nodesOf([b])
+        index = { 0 : 0 }
+        for i,node in enumerate(nodes):
+            index[node] = i+1
+        counts = numpy.zeros((len(nodes)+1,queries),dtype=dtype)
+
+        # Counts of the refs 'refs' over the variables from level 'var'
+        # onwards, one row per ref.
+
+        def countsFrom(refs,var):
+            rows = numpy.array([ index[r >> 1] for r in refs ])
+            flips = numpy.array([ r & 1 for r in refs ],dtype=bool)
+            below = free[[ self.nodeVar[r >> 1] for r in refs ]]
+            c = counts[rows]
+            c = numpy.where(flips[:,None],below - c,c)
+            return c * (free[var] // below)
+
+        start = 0
+        while start < len(nodes):
+            level = self.nodeVar[nodes[start]]
+            end = start
+            while end < len(nodes) and self.nodeVar[nodes[end]] == level:
+                end += 1
+            group = nodes[start:end]
+            pos = countsFrom([ self.posChild[node] for node in group ],level+1)
+            neg = countsFrom([ self.negChild[node] for node in group ],level+1)
+            counts[start+1:end+1] = numpy.where(values[level] != -1,pos,0) + numpy.where(values[level] != 1,neg,0)
+            start = end
+        return countsFrom([b],0)[0]
+
+    # Uniform sampling of models
+    #
+    # samples(b,seed) generates an endless stream of models of b, each
+    # drawn uniformly at random and independently of the others, as
+    # dictionaries from variable names to truth values. At each node
+    # the positive child is followed with probability proportional to
+    # its model-count, and the variables skipped between the nodes get
+    # random values, so a model is drawn in time linear in the number of
+    # variables, without rejection. sample(b,k,seed) returns a list of k
+    # models. The OBDD must not be changed while samples are drawn.
+
+    def samples(self,b,seed=None):
+        if b == 0:
+            raise ValueError("cannot sample from an unsatisfiable OBDD")
+        rng = random.Random(seed)
+        n = len(self.vars)
+        while True:
+            model = dict()
+            r = b
+            var = 0
+            while var < n:
+                level = self.nodeVar[r >> 1]
+                while var < level:
+                    model[self.vars[var]] = rng.getrandbits(1) == 1
+                    var += 1
+                if level == n:
+                    break
+                pos,neg = self.cofactors(r,level)
+                posCount = self.countFrom(pos,level+1)
+                value = rng.randrange(posCount + self.countFrom(neg,level+1)) < posCount
+                model[self.vars[level]] = value
+                r = pos if value else neg
+                var = level+1
+            yield model
+
+    def sample(self,b,k,seed=None):
+        models = self.samples(b,seed)
+        return [ next(models) for i in range(0,k) ]
+
+    # All non-terminal nodes reachable from the OBDDs 'roots',
+    # ordered so that children come before their parents.
+
+    def nodesOf(self,roots):
+        visited = set()
+        stack = [ b >> 1 for b in roots ]
+        while stack:
+            node = stack.pop()
+            if node == 0 or node in visited:
+                continue
+            visited.add(node)
+            stack.append(self.posChild[node] >> 1)
+            stack.append(self.negChild[node] >> 1)
+        return sorted(visited,key=lambda node : self.nodeVar[node],reverse=True)
+
+    # Weighted model-counting
+    #
+    # 'weights' maps variables to pairs (wpos,wneg) of the weights of
+    # the positive and the negative literal. Variables that are not
+    # in 'weights' have weight 1 for both literals. The weight of an
+    # assignment is the product of the weights of its literals, and
+    # the weighted model-count of an OBDD is the sum of the weights
+    # of its models.
+    #
+    # The weighted counts of the nodes are cached in 'weightedCounts',
+    # which maps a node n to its weighted count over the variables
+    # from nodeVar[n] onwards. The cache is emptied when the weights
+    # are changed.
+
+    def setWeights(self,weights):
+        self.weights = weights
+        n = len(self.vars)
+        self.posWeight = [ weights.get(v,(1,1))[0] for v in self.vars ]
+        self.negWeight = [ weights.get(v,(1,1))[1] for v in self.vars ]
+        self.weightedCounts = { 0 : 0 }
+
+        # levelWeights[i] is the total weight of all assignments to
+        # the variables from index i onwards.
+
+        self.levelWeights = [1] * (n+1)
+        for i in reversed(range(0,n)):
+            self.levelWeights[i] = (self.posWeight[i] + self.negWeight[i]) * self.levelWeights[i+1]
+
+        # Total weights of the variables from i to j-1, for skipped
+        # variables, with (i,j) as the key.
+
+        self.gapWeights = dict()
+
+    def gapWeight(self,i,j):
+        if i == j:
+            return 1
+        w = self.gapWeights.get((i,j))
+        if w is None:
+            w = 1
+            for k in range(i,j):
+                w = w * (self.posWeight[k] + self.negWeight[k])
+            self.gapWeights[(i,j)] = w
+        return w
+
+    # Weighted count of b over the variables from index 'var' onwards,
+    # when the weighted count of the node of b is already cached.
+
+    def weightedCountFrom(self,b,var):
+        node = b >> 1
+        level = self.nodeVar[node]
+        count = self.weightedCounts[node]
+        if b & 1:
+            count = self.levelWeights[level] - count
+        return count * self.gapWeight(var,level)
+
+    # Return the weighted model-count of b. The nodes whose weighted
+    # counts are not cached yet are visited once, children first.
+
+    def weightedCount(self,b):
+        for node in self.nodesOf([b]):
+            if node in self.weightedCounts:
+                continue
+            var = self.nodeVar[node]
+            count1 = self.weightedCountFrom(self.posChild[node],var+1)
+            count2 = self.weightedCountFrom(self.negChild[node],var+1)
+            self.weightedCounts[node] = self.posWeight[var] * count1 + self.negWeight[var] * count2
+        return self.weightedCountFrom(b,0)
 
     # Constructors for OBDDs
     #
     # Create an OBDD representing an atomic propositions.
 
     def atom(self,a):
-        return self.newOBDDnode(a,1,0)
+        return self.newOBDDnode(self.varIndex[a],1,0)
 
     # Constructors for common Boolean functions:
         
@@ -162,8 +776,10 @@ class OBDD():
     def disj(self,b1,b2):
         return self.apply(OR,b1,b2)
 
+    # Negation only flips the complement bit of the reference.
+
     def neg(self,b):
-        return self.apply(XOR,b,1)
+        return b ^ 1
 
     def impl(self,b1,b2):
         return self.apply(IMPL,b1,b2)
@@ -171,14 +787,868 @@ class OBDD():
     def eqvi(self,b1,b2):
         return self.apply(EQVI,b1,b2)
 
+    # If-then-else: (b1 and b2) or (not b1 and b3)
+
+    def ite(self,b1,b2,b3):
+        self.checkpoint(b1,b2,b3)
+        return self.operation("ite",lambda : self.disj(self.conj(b1,b2),self.conj(b1 ^ 1,b3)))
+
+    # Number of non-terminal nodes in an OBDD
+
+    def size(self,b):
+        return len(self.nodesOf([b]))
+
     # Chain conjunction and disjunction
+    #
+    # 'mode' is the order in which the OBDDs are combined:
+    #    "left"     : fold from left to right, ((b1 & b2) & b3) & ...
+    #    "balanced" : combine neighbours pairwise, in a balanced tree
+    #                 (b1 & b2) & (b3 & b4), ...
+    #    "smallest" : always combine the two smallest OBDDs
+    # The balanced and smallest-first orders keep the intermediate
+    # OBDDs small for long lists, for example when compiling CNFs.
+    #
+    # If 'stats' is a dictionary, stats["peak"] is set to the size of
+    # the largest intermediate OBDD, and stats["steps"] to the number
+    # of binary operations.
+
+    def conjs(self,bb,mode="balanced",stats=None):
+        return self.applyList(AND,bb,1,mode,stats)
+
+    def disjs(self,bb,mode="balanced",stats=None):
+        return self.applyList(OR,bb,0,mode,stats)
 
-    def conjs(self,bb):
-        return reduce(self.conj,bb,1)
+    def applyList(self,f,bb,unit,mode,stats):
+        bb = list(bb)
+        peak = 0
+        steps = 0
+
+        # The operands and the intermediate OBDDs are referenced until
+        # they have been combined, so that garbage collection between
+        # the steps does not free them.
+
+        for b in bb:
+            self.ref(b)
+
+        def combine(b1,b2):
+            nonlocal peak,steps
+            b = self.ref(self.apply(f,b1,b2))
+            self.deref(b1)
+            self.deref(b2)
+            steps += 1
+            if stats is not None:
+                peak = max(peak,self.size(b))
+            return b
+
+        if mode == "left":
+            result = reduce(combine,bb,unit)
+        elif mode == "balanced":
+            while len(bb) > 1:
+                pairs = [ combine(bb[i],bb[i+1]) for i in range(0,len(bb)-1,2) ]
+                if len(bb) % 2 == 1:
+                    pairs.append(bb[-1])
+                bb = pairs
+            result = bb[0] if bb else unit
+        elif mode == "smallest":
+            queue = [ (self.size(b),i,b) for i,b in enumerate(bb) ]
+            heapq.heapify(queue)
+            counter = len(queue)
+            while len(queue) > 1:
+                _,_,b1 = heapq.heappop(queue)
+                _,_,b2 = heapq.heappop(queue)
+                b = combine(b1,b2)
+                heapq.heappush(queue,(self.size(b),counter,b))
+                counter += 1
+            result = queue[0][2] if queue else unit
+        else:
+            raise ValueError("unknown mode: " + str(mode))
+        self.deref(result)
+        if stats is not None:
+            stats["peak"] = peak
+            stats["steps"] = steps
+        return result
+
+    # Rebuild an OBDD bottom-up, with an explicit stack as in apply.
+    #
+    # 'leaf(b)' returns the result for b if it can be given directly,
+    # and None otherwise. 'combine(var,r1,r2)' returns the result for
+    # a node with variable 'var' from the results r1 and r2 for its
+    # positive and negative children. Results are cached in 'cache',
+    # by default the computed table, with keys (op,b,tag).
+    #
+    # If 'select' is given, select(var) may return True or False to
+    # make the result for a node with variable 'var' the result for
+    # its positive or negative child only, without visiting the other
+    # child. If it returns None, combine is used as usual.
 
-    def disjs(self,bb):
-        return reduce(self.disj,bb,0)
+    def transform(self,op,tag,b,leaf,combine,select=None,cache=None):
+        if cache is None:
+            cache = self.cache
+        return self.operation(op,lambda : self.transformLoop(op,tag,b,leaf,combine,select,cache))
 
+    def transformLoop(self,op,tag,b,leaf,combine,select,cache):
+        results = []
+        stack = [(b,)]
+        while stack:
+            task = stack.pop()
+            if len(task) == 3:
+                var,key,selected = task
+                if selected is None:
+                    r2 = results.pop()
+                    r1 = results.pop()
+                    result = combine(var,r1,r2)
+                else:
+                    result = results.pop()
+                cache.insert(key,result)
+                results.append(result)
+                continue
+            b = task[0]
+            result = leaf(b)
+            if result is None:
+                key = (op,b,tag)
+                result = cache.lookup(key)
+                if result is None:
+                    var = self.rootVar(b)
+                    pos,neg = self.cofactors(b,var)
+                    selected = select(var) if select else None
+                    stack.append((var,key,selected))
+                    if selected is None:
+                        stack.append((neg,))
+                        stack.append((pos,))
+                    else:
+                        stack.append((pos if selected else neg,))
+                    continue
+            results.append(result)
+        return results.pop()
+
+    # Quantification
+    #
+    # The quantified variables are given as a list of variable names.
+    # Internally they are represented by the cube (conjunction) of the
+    # variables, which identifies the variable set in the computed
+    # table, so cached results are reused across calls.
+
+    def cube(self,vars):
+        b = 1
+        for var in sorted({ self.varIndex[v] for v in vars },reverse=True):
+            b = self.newOBDDnode(var,b,0)
+        return b
+
+    # The set of variable indices in a cube
+
+    def cubeVars(self,cube):
+        vars = set()
+        while cube > 1:
+            vars.add(self.rootVar(cube))
+            cube = self.posChild[cube >> 1]
+        return vars
+
+    # Existential abstraction: exists vars . b
+
+    def exists(self,vars,b):
+        cube = self.cube(vars)
+        qvars = self.cubeVars(cube)
+        if not qvars:
+            return b
+        last = max(qvars)
+
+        def leaf(b):
+            if b < 2 or self.rootVar(b) > last:
+                return b
+            return None
+
+        def combine(var,r1,r2):
+            if var in qvars:
+                return self.apply(OR,r1,r2)
+            return self.newOBDDnode(var,r1,r2)
+
+        return self.transform("exists",cube,b,leaf,combine)
+
+    # Universal abstraction: forall vars . b = not exists vars . not b
+
+    def forall(self,vars,b):
+        return self.exists(vars,b ^ 1) ^ 1
+
+    # Relational product: exists vars . (b1 and b2), computed without
+    # constructing the conjunction b1 and b2 first. Quantification is
+    # done during the same traversal as the conjunction, and a
+    # quantified node whose positive branch is TRUE is TRUE without
+    # looking at the negative branch.
+    #
+    # The stack has three kinds of entries, as in apply:
+    #    (b1,b2) : compute the relational product for b1 and b2
+    #    (var,key,neg1,neg2) : the positive branch has been computed;
+    #                          continue with the negative branch
+    #    (var,key,None) : both branches have been computed
+
+    def and_exists(self,b1,b2,vars):
+        cube = self.cube(vars)
+        qvars = self.cubeVars(cube)
+        if not qvars:
+            return self.apply(AND,b1,b2)
+        return self.operation("and_exists",lambda : self.andExistsLoop(b1,b2,vars,cube,qvars))
+
+    def andExistsLoop(self,b1,b2,vars,cube,qvars):
+        last = max(qvars)
+        cache = self.cache
+        results = []
+        stack = [(b1,b2)]
+        while stack:
+            task = stack.pop()
+            if len(task) == 2:
+                b1,b2 = task
+                if b1 == 0 or b2 == 0 or b1 == b2 ^ 1:
+                    results.append(0)
+                    continue
+                if b1 == 1 or b1 == b2:
+                    results.append(self.exists(vars,b2))
+                    continue
+                if b2 == 1:
+                    results.append(self.exists(vars,b1))
+                    continue
+                if b1 > b2:
+                    b1,b2 = b2,b1
+                var = min(self.rootVar(b1),self.rootVar(b2))
+                if var > last:
+                    results.append(self.apply(AND,b1,b2))
+                    continue
+                key = ("and_exists",cube,b1,b2)
+                result = cache.lookup(key)
+                if result is not None:
+                    results.append(result)
+                    continue
+                pos1,neg1 = self.cofactors(b1,var)
+                pos2,neg2 = self.cofactors(b2,var)
+                stack.append((var,key,neg1,neg2))
+                stack.append((pos1,pos2))
+            elif len(task) == 4:
+                var,key,neg1,neg2 = task
+                if var in qvars and results[-1] == 1:
+                    cache.insert(key,1)
+                    continue
+                stack.append((var,key,None))
+                stack.append((neg1,neg2))
+            else:
+                var,key,_ = task
+                r2 = results.pop()
+                r1 = results.pop()
+                if var in qvars:
+                    result = self.apply(OR,r1,r2)
+                else:
+                    result = self.newOBDDnode(var,r1,r2)
+                cache.insert(key,result)
+                results.append(result)
+        return results.pop()
+
+    # Restriction and composition
+    #
+    # restrict(b,assignment) is b with the variables in 'assignment',
+    # a dictionary from variable names to truth values, replaced by
+    # their values. The assignment is represented by the cube of its
+    # literals, which identifies it in the computed table, so that
+    # repeated queries with the same assignment reuse the results, and
+    # only the part of b above the last assigned variable is visited.
+
+    def literalCube(self,assignment):
+        b = 1
+        for var,value in sorted([ (self.varIndex[v],value) for v,value in assignment.items() ],reverse=True):
+            if value:
+                b = self.newOBDDnode(var,b,0)
+            else:
+                b = self.newOBDDnode(var,0,b)
+        return b
+
+    # The assignment of a cube of literals, from variable indices to
+    # truth values
+
+    def cubeLiterals(self,cube):
+        literals = dict()
+        while cube > 1:
+            var = self.rootVar(cube)
+            pos,neg = self.cofactors(cube,var)
+            literals[var] = pos != 0
+            cube = pos if pos != 0 else neg
+        return literals
+
+    def restrict(self,b,assignment):
+        cube = self.literalCube(assignment)
+        literals = self.cubeLiterals(cube)
+        if not literals:
+            return b
+        last = max(literals)
+
+        def leaf(b):
+            if b < 2 or self.rootVar(b) > last:
+                return b
+            return None
+
+        def combine(var,r1,r2):
+            return self.newOBDDnode(var,r1,r2)
+
+        return self.transform("restrict",cube,b,leaf,combine,literals.get)
+
+    # Composition: b with the variable 'var' replaced by the OBDD g,
+    # that is, g ? b[var := 1] : b[var := 0]
+
+    def compose(self,b,var,g):
+        self.checkpoint(b,g)
+        return self.operation("compose",lambda : self.ite(g,self.restrict(b,{ var : True }),self.restrict(b,{ var : False })))
+
+    # Simultaneous composition: b with every variable v in 'substitution',
+    # a dictionary from variable names to OBDDs, replaced by
+    # substitution[v]. Unlike a sequence of compose calls, variables
+    # occurring in the substituted OBDDs are not substituted again.
+    # The results are cached only for the duration of the call.
+
+    def vector_compose(self,b,substitution):
+        self.checkpoint(b,*substitution.values())
+        subst = { self.varIndex[v] : g for v,g in substitution.items() }
+        if not subst:
+            return b
+        last = max(subst)
+
+        def leaf(b):
+            if b < 2 or self.rootVar(b) > last:
+                return b
+            return None
+
+        def combine(var,r1,r2):
+            if var not in subst:
+                if self.rootVar(r1) > var and self.rootVar(r2) > var:
+                    return self.newOBDDnode(var,r1,r2)
+                return self.ite(self.newOBDDnode(var,1,0),r1,r2)
+            return self.ite(subst[var],r1,r2)
+
+        memo = ComputedTable(len(self.nodeVar),"clear")
+        return self.transform("vector_compose",None,b,leaf,combine,None,memo)
+
+    # Dynamic variable reordering
+    #
+    # Swap the variables at indices i and i+1 in place. Let x be the
+    # variable at i and y the variable at i+1.
+    #    - The nodes for y move to index i unchanged.
+    #    - The nodes for x that do not have a child with y move to
+    #      index i+1 unchanged.
+    #    - A node f = x ? (y ? f11 : f10) : (y ? f01 : f00) for x that
+    #      has a child with y is rewritten in place as the node
+    #      y ? (x ? f11 : f01) : (x ? f10 : f00) for y, so that all
+    #      references to f stay valid.
+    #
+    # The nodes that are no longer referenced after the swap are freed,
+    # except for the pinned nodes (see reorder).
+
+    def swap(self,i):
+        j = i+1
+        xnodes = self.hash[i]
+        ynodes = self.hash[j]
+
+        # Find the nodes for x that depend on y, with their cofactors
+        # for x and y.
+
+        moved = dict()
+        rewritten = []
+        for (child1,child2),node in xnodes.items():
+            if self.rootVar(child1) != j and self.rootVar(child2) != j:
+                moved[(child1,child2)] = node
+            else:
+                f11,f10 = self.cofactors(child1,j)
+                f01,f00 = self.cofactors(child2,j)
+                rewritten.append((node,f11,f10,f01,f00))
+
+        # Swap the variables and the unique tables.
+
+        x,y = self.vars[i],self.vars[j]
+        self.vars[i],self.vars[j] = y,x
+        self.varIndex[x],self.varIndex[y] = j,i
+        self.hash[i],self.hash[j] = ynodes,moved
+        for node in ynodes.values():
+            self.nodeVar[node] = i
+            self.updateCount(node)
+        for node in moved.values():
+            self.nodeVar[node] = j
+            self.updateCount(node)
+
+        # Rewrite the nodes that depend on y. Their model-counts
+        # do not change, because they represent the same function
+        # over the same variables. The references to the old children
+        # are released only after all nodes have been rewritten, so
+        # that the old children can be reused for the new ones.
+
+        released = []
+        for node,f11,f10,f01,f00 in rewritten:
+            child1 = self.newOBDDnode(j,f11,f01)
+            child2 = self.newOBDDnode(j,f10,f00)
+            live = self.liveRefs[node] > 0
+            for child in (child1,child2):
+                self.nodeRefs[child >> 1] += 1
+                if live:
+                    self.addLiveRef(child >> 1)
+            for old in (self.posChild[node],self.negChild[node]):
+                released.append((old >> 1,live))
+            self.posChild[node] = child1
+            self.negChild[node] = child2
+            ynodes[(child1,child2)] = node
+        for node,live in released:
+            self.nodeRefs[node] -= 1
+            if live:
+                self.removeLiveRef(node)
+
+        # Free the nodes that became unreferenced.
+
+        unreferenced = [ node for node,live in released ]
+        while unreferenced:
+            node = unreferenced.pop()
+            if node == 0 or node < self.pinned or self.nodeVar[node] < 0:
+                continue
+            if self.nodeRefs[node] > 0 or self.extRefs[node] > 0:
+                continue
+            self.freeNode(node)
+            unreferenced.append(self.posChild[node] >> 1)
+            unreferenced.append(self.negChild[node] >> 1)
+
+    # Live nodes are those reachable from the roots, and the other nodes
+    # are dead. liveRefs[n] is the number of live parents of n, plus its
+    # number of references as a root, and 'liveCount' is the number of
+    # nodes with liveRefs[n] > 0. With automatic garbage collection the
+    # roots are the externally referenced nodes. During reordering
+    # without it, the roots are also the nodes that had no parents when
+    # reordering started.
+
+    def addLiveRef(self,node):
+        stack = [node]
+        while stack:
+            node = stack.pop()
+            if node == 0:
+                continue
+            self.liveRefs[node] += 1
+            if self.liveRefs[node] == 1:
+                self.liveCount += 1
+                stack.append(self.posChild[node] >> 1)
+                stack.append(self.negChild[node] >> 1)
+
+    def removeLiveRef(self,node):
+        stack = [node]
+        while stack:
+            node = stack.pop()
+            if node == 0:
+                continue
+            self.liveRefs[node] -= 1
+            if self.liveRefs[node] == 0:
+                self.liveCount -= 1
+                stack.append(self.posChild[node] >> 1)
+                stack.append(self.negChild[node] >> 1)
+
+    # Move the variable at index i to index 'to' by adjacent swaps.
+
+    def moveVar(self,i,to):
+        while i < to:
+            self.swap(i)
+            i += 1
+        while i > to:
+            self.swap(i-1)
+            i -= 1
+
+    # Rudell's sifting: each variable, starting from those with most
+    # nodes, is moved through all indices, and left at the index where
+    # the OBDDs were smallest. The variable is first moved towards the
+    # nearer end of the ordering, and then towards the other end.
+    # Moving in a direction stops when the size exceeds 'maxGrowth'
+    # times the best size so far.
+
+    def sift(self):
+        n = len(self.vars)
+        for v in sorted(self.vars,key=lambda v : len(self.hash[self.varIndex[v]]),reverse=True):
+            pos = self.varIndex[v]
+            best = self.liveCount
+            bestPos = pos
+            if pos < n // 2:
+                ends = [n-1,0]
+            else:
+                ends = [0,n-1]
+            for end in ends:
+                step = 1 if end > pos else -1
+                while pos != end:
+                    self.moveVar(pos,pos+step)
+                    pos += step
+                    if self.liveCount < best:
+                        best = self.liveCount
+                        bestPos = pos
+                    elif self.liveCount > self.maxGrowth * best:
+                        break
+            self.moveVar(pos,bestPos)
+
+    # Reorder the variables by sifting. Cached weighted counts depend
+    # on the ordering, and are recomputed. Returns the number of live
+    # nodes after reordering.
+    #
+    # With automatic garbage collection, the dead nodes are collected
+    # first, and any node that dies during sifting is freed. Otherwise
+    # all existing nodes are pinned, as they may be referenced from
+    # outside of the OBDD manager as plain integers, and only the nodes
+    # both created and abandoned during sifting are freed.
+
+    def reorder(self):
+        if self.gcThreshold is None:
+            self.pinned = len(self.nodeVar)
+            roots = [ node for unique in self.hash for node in unique.values() if self.nodeRefs[node] == 0 or self.extRefs[node] > 0 ]
+            self.liveRefs = array('i',[0]) * len(self.nodeVar)
+            self.liveCount = 0
+            for node in roots:
+                self.addLiveRef(node)
+            self.sift()
+            self.liveRefs = None
+            self.pinned = 0
+        else:
+            self.collect()
+            self.sift()
+            self.cache.clear()
+        self.setWeights(self.weights)
+        return self.liveCount
+
+    # Collect garbage and reorder automatically, if enabled and due,
+    # when no operation is in progress. The operands 'bb' of the
+    # operation that is starting are kept.
+
+    def checkpoint(self,*bb):
+        if self.busy:
+            return
+        gc = self.gcThreshold is not None and self.liveNodes >= self.gcMinNodes and \
+             self.liveNodes - self.liveCount > self.gcThreshold * self.liveNodes
+        reorder = self.reorderThreshold is not None and self.liveNodes >= self.reorderThreshold
+        if not (gc or reorder):
+            return
+        for b in bb:
+            self.ref(b)
+        if gc:
+            self.collect()
+        if reorder:
+            self.reorder()
+            self.reorderThreshold = max(self.reorderThreshold,2 * self.liveNodes)
+        for b in bb:
+            self.deref(b)
+
+    # Garbage collection
+    #
+    # External references to an OBDD b: ref(b) adds one and returns b,
+    # and deref(b) removes one. References to the terminal are ignored.
+
+    def ref(self,b):
+        node = b >> 1
+        if node != 0:
+            self.extRefs[node] += 1
+            if self.liveRefs is not None:
+                self.addLiveRef(node)
+        return b
+
+    def deref(self,b):
+        node = b >> 1
+        if node != 0:
+            if self.extRefs[node] <= 0:
+                raise ValueError("OBDD " + str(b) + " is not referenced")
+            self.extRefs[node] -= 1
+            if self.liveRefs is not None:
+                self.removeLiveRef(node)
+
+    # Approximate number of bytes used by a node: its entries in the
+    # node store columns and its key and entry in the unique table.
+
+    def nodeBytes(self,node):
+        columns = [self.nodeVar,self.posChild,self.negChild,self.nodeRefs,self.extRefs]
+        if self.liveRefs is not None:
+            columns.append(self.liveRefs)
+        key = (self.posChild[node],self.negChild[node])
+        return sum([ c.itemsize for c in columns ]) + sys.getsizeof(self.modelCount[node]) + \
+               sys.getsizeof(key) + sum([ sys.getsizeof(k) for k in key ]) + 3*8
+
+    # Remove a node from the unique table, and put its index in the
+    # free list. The references it holds to its children are removed.
+
+    def freeNode(self,node):
+        del self.hash[self.nodeVar[node]][(self.posChild[node],self.negChild[node])]
+        self.nodeRefs[self.posChild[node] >> 1] -= 1
+        self.nodeRefs[self.negChild[node] >> 1] -= 1
+        self.nodeVar[node] = -1
+        self.modelCount[node] = 0
+        self.liveNodes -= 1
+        self.freeNodes.append(node)
+
+    # Mark-and-sweep garbage collection. Frees all nodes that are not
+    # reachable from the externally referenced nodes or from the OBDDs
+    # 'roots', and removes the computed table entries and the cached
+    # weighted counts that refer to the freed nodes. Returns the
+    # number of bytes reclaimed. The node store columns keep their
+    # length, and the freed entries are reused for new nodes.
+
+    def collect(self,roots=()):
+        referenced = [ node << 1 for unique in self.hash for node in unique.values() if self.extRefs[node] > 0 ]
+        live = set(self.nodesOf(referenced + list(roots)))
+        dead = [ node for unique in self.hash for node in unique.values() if node not in live ]
+        reclaimed = 0
+        for node in dead:
+            reclaimed += self.nodeBytes(node)
+        for node in dead:
+            self.freeNode(node)
+        freed = set(dead)
+
+        def stale(key,result):
+            if result >> 1 in freed:
+                return True
+            for x in key:
+                if isinstance(x,int) and x >> 1 in freed:
+                    return True
+            return False
+
+        if freed:
+            self.cache.purge(stale)
+            for node in freed:
+                self.weightedCounts.pop(node,None)
+        if self.liveRefs is not None:
+            for node in freed:
+                self.liveRefs[node] = 0
+        self.gcRuns += 1
+        self.freedNodes += len(dead)
+        self.reclaimedBytes += reclaimed
+        return reclaimed
+
+    # Instrumentation
+    #
+    # Run the operation 'op' as run(), during which garbage collection
+    # and reordering are not done. The call is counted in 'opCalls',
+    # and if it is not part of another operation, its running time is
+    # reported to the timer.
+
+    def operation(self,op,run):
+        self.opCalls[op] = self.opCalls.get(op,0) + 1
+        timing = self.timer is not None and not self.busy
+        if timing:
+            start = time.perf_counter()
+        self.busy += 1
+        try:
+            return run()
+        finally:
+            self.busy -= 1
+            if timing:
+                self.timer(op,time.perf_counter() - start)
+
+    # Statistics of the OBDD manager, as a dictionary:
+    #    "nodes" : the number of nodes (not counting the terminal)
+    #    "live" : the number of live nodes, if known (see addLiveRef)
+    #    "levelNodes" : the number of nodes of each variable, as a
+    #                   dictionary in the order of the variables
+    #    "peakNodes" : the largest number of nodes so far
+    #    "uniqueLoad" : the estimated load factor of the unique tables
+    #    "cacheEntries", "cacheHits", "cacheMisses", "cacheEvictions",
+    #    "cacheHitRate" : the state of the computed table
+    #    "opCalls" : the number of calls of each operation
+    #    "storeBytes" : the memory of the node store, which is also its
+    #                   peak memory, as the store never shrinks
+    #    "uniqueBytes" : the memory of the unique tables
+    #    "gcRuns", "freedNodes", "reclaimedBytes" : totals of garbage
+    #                                               collection
+    #
+    # The unique table of a variable is a Python dictionary, which is
+    # grown so that it is at most 2/3 full. Its number of slots is
+    # estimated as the smallest power of two at least 8 that keeps it
+    # so, and the load factor is that of all of the tables together.
+
+    def stats(self):
+        slots = 0
+        for unique in self.hash:
+            size = 8
+            while 3 * len(unique) > 2 * size:
+                size *= 2
+            slots += size
+        columns = [self.nodeVar,self.posChild,self.negChild,self.nodeRefs,self.extRefs]
+        if self.liveRefs is not None:
+            columns.append(self.liveRefs)
+        return {
+            "nodes" : self.liveNodes,
+            "live" : self.liveCount if self.liveRefs is not None else None,
+            "levelNodes" : { self.vars[var] : len(unique) for var,unique in enumerate(self.hash) },
+            "peakNodes" : len(self.nodeVar) - 1,
+            "uniqueLoad" : self.liveNodes / slots if slots else 0.0,
+            "cacheEntries" : len(self.cache),
+            "cacheHits" : self.cache.hits,
+            "cacheMisses" : self.cache.misses,
+            "cacheEvictions" : self.cache.evictions,
+            "cacheHitRate" : self.cache.hitRate(),
+            "opCalls" : dict(self.opCalls),
+            "storeBytes" : sum([ c.itemsize * len(c) for c in columns ]) + sys.getsizeof(self.modelCount) + \
+                           sum([ sys.getsizeof(c) for c in self.modelCount ]),
+            "uniqueBytes" : sum([ sys.getsizeof(unique) for unique in self.hash ]),
+            "gcRuns" : self.gcRuns,
+            "freedNodes" : self.freedNodes,
+            "reclaimedBytes" : self.reclaimedBytes
+        }
+
+    # Saving and loading
+    #
+    # save(filename,roots) writes the OBDDs in the list 'roots' to a
+    # binary file (see MappedOBDD for the format). load(filename) adds
+    # the OBDDs in a file to this manager, and returns their list. The
+    # variables of the file must be variables of the manager. If they
+    # are in the same order, the nodes are created directly, and
+    # otherwise with ite.
+
+    def save(self,filename,roots):
+        nodes = self.nodesOf(roots)
+        index = { 0 : 0 }
+        for i,node in enumerate(nodes):
+            index[node] = i+1
+
+        def fileRef(b):
+            return (index[b >> 1] << 1) | (b & 1)
+
+        with open(filename,"wb") as f:
+            f.write(MAGIC)
+            f.write(HEADER.pack(FORMAT_VERSION,len(self.vars),len(nodes),len(roots)))
+            for v in self.vars:
+                name = v.encode("utf-8")
+                f.write(NAME_LENGTH.pack(len(name)))
+                f.write(name)
+            for b in roots:
+                f.write(ROOT.pack(fileRef(b)))
+            for node in nodes:
+                f.write(NODE.pack(self.nodeVar[node],fileRef(self.posChild[node]),fileRef(self.negChild[node])))
+
+    def load(self,filename):
+        with MappedOBDD(filename) as mapped:
+            levels = [ self.varIndex[v] for v in mapped.vars ]
+            ordered = all([ levels[i] < levels[i+1] for i in range(0,len(levels)-1) ])
+            refs = [0] * (mapped.nodes+1)
+
+            def ref(b):
+                return refs[b >> 1] ^ (b & 1)
+
+            self.busy += 1
+            try:
+                for i in range(1,mapped.nodes+1):
+                    level,pos,neg = mapped.node(i)
+                    if ordered:
+                        refs[i] = self.newOBDDnode(levels[level],ref(pos),ref(neg))
+                    else:
+                        refs[i] = self.ite(self.newOBDDnode(levels[level],1,0),ref(pos),ref(neg))
+            finally:
+                self.busy -= 1
+            return [ ref(b) for b in mapped.roots ]
+
+    # A handle for an OBDD holds an external reference to it for
+    # as long as the handle exists.
+
+    def handle(self,b):
+        return OBDDhandle(self,b)
+
+# Create an OBDD manager with the variable ordering of an OBDD file,
+# and load the OBDDs in the file into it. Returns the manager and the
+# list of the OBDDs. The other arguments are as for OBDD.
+
+def loadOBDD(filename,**options):
+    with MappedOBDD(filename) as mapped:
+        vars = mapped.vars
+    BDD = OBDD(vars,**options)
+    return BDD,BDD.load(filename)
+
+# OBDD files
+#
+# An OBDD file consists of, with all integers little-endian:
+#    - the magic bytes "OBDD"
+#    - a header: the format version, the number of variables, the
+#      number of nodes and the number of roots (4-byte unsigned)
+#    - the variable names, in the order of the OBDD, each as its
+#      length (4-byte unsigned) followed by its UTF-8 bytes
+#    - the roots, as references (8-byte signed)
+#    - the nodes 1,2,3,..., each as its variable index (4-byte signed)
+#      and the references to its positive and negative children
+#      (8-byte signed)
+# References are as in OBDD: 2*n+c for the node n, complemented if
+# c=1, and node 0 is the terminal FALSE. Children come before their
+# parents, so every node refers only to nodes before it.
+
+MAGIC = b"OBDD"
+FORMAT_VERSION = 1
+HEADER = struct.Struct("<IIII")
+NAME_LENGTH = struct.Struct("<I")
+ROOT = struct.Struct("<q")
+NODE = struct.Struct("<iqq")
+
+# Read-only OBDDs of an OBDD file, accessed through a memory map, so
+# that the nodes are read from the file only as they are visited, and
+# opening a file takes time independent of the number of nodes.
+# OBDDs are references as in the file, and 'roots' is their list.
+# The model-counts of all nodes are computed in one pass over the
+# file the first time they are needed.
+
+class MappedOBDD():
+    def __init__(self,filename):
+        self.file = open(filename,"rb")
+        self.data = mmap.mmap(self.file.fileno(),0,access=mmap.ACCESS_READ)
+        if self.data[0:len(MAGIC)] != MAGIC:
+            self.close()
+            raise ValueError("not an OBDD file: " + filename)
+        offset = len(MAGIC)
+        version,nvars,self.nodes,nroots = HEADER.unpack_from(self.data,offset)
+        if version != FORMAT_VERSION:
+            self.close()
+            raise ValueError("unsupported OBDD file version: " + str(version))
+        offset += HEADER.size
+        self.vars = []
+        for i in range(0,nvars):
+            length, = NAME_LENGTH.unpack_from(self.data,offset)
+            offset += NAME_LENGTH.size
+            self.vars.append(self.data[offset:offset+length].decode("utf-8"))
+            offset += length
+        self.varIndex = { v : i for i,v in enumerate(self.vars) }
+        self.roots = [ ROOT.unpack_from(self.data,offset + i*ROOT.size)[0] for i in range(0,nroots) ]
+        self.nodesOffset = offset + nroots*ROOT.size
+        self.counts = None
+
+    def close(self):
+        self.data.close()
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self,*exc):
+        self.close()
+
+    # The variable index and the references to the children of node i
+
+    def node(self,i):
+        return NODE.unpack_from(self.data,self.nodesOffset + (i-1)*NODE.size)
+
+    # Index of the root variable of an OBDD.
+
+    def rootVar(self,b):
+        if b >> 1 == 0:
+            return len(self.vars)
+        return self.node(b >> 1)[0]
+
+    # The truth value of b under 'assignment', a dictionary from the
+    # variable names to truth values.
+
+    def evaluate(self,b,assignment):
+        while b >> 1 != 0:
+            level,pos,neg = self.node(b >> 1)
+            b = (pos if assignment[self.vars[level]] else neg) ^ (b & 1)
+        return b == 1
+
+    # Model-counting as in OBDD.countFrom and OBDD.countModels
+
+    def countFrom(self,b,var):
+        if self.counts is None:
+            self.counts = [0] * (self.nodes+1)
+            for i in range(1,self.nodes+1):
+                level,pos,neg = self.node(i)
+                self.counts[i] = self.countFrom(pos,level+1) + self.countFrom(neg,level+1)
+        level = self.rootVar(b)
+        count = self.counts[b >> 1]
+        if b & 1:
+            count = (1 << (len(self.vars) - level)) - count
+        return count << (level - var)
+
+    def countModels(self,b):
+        return self.countFrom(b,0)
 
 # Run some tests.
 
@@ -198,6 +1668,247 @@ if __name__ == "__main__":
     BDD.conj(BDD.eqvi(A,B),BDD.eqvi(C,D))
     BDD.conj(BDD.eqvi(A,D),BDD.eqvi(B,C))
     BDD.conj(BDD.eqvi(A,C),BDD.eqvi(B,D))
+
+    # Checks against truth-tables. The truth-table of a function of
+    # the variables 'names' is an integer, with bit k set if the
+    # function is true when each names[i] has the value of bit i of k.
+
+    def truthTable(BDD,b,names):
+        table = 0
+        for k in range(0,1 << len(names)):
+            r = b
+            while r >> 1 != 0:
+                node = r >> 1
+                if (k >> names.index(BDD.vars[BDD.nodeVar[node]])) & 1:
+                    r = BDD.posChild[node] ^ (r & 1)
+                else:
+                    r = BDD.negChild[node] ^ (r & 1)
+            if r == 1:
+                table |= 1 << k
+        return table
+
+    def atomTable(i,names):
+        return sum([ 1 << k for k in range(0,1 << len(names)) if (k >> i) & 1 ])
+
+    def check(BDD,b,table,names):
+        assert truthTable(BDD,b,names) == table
+        assert BDD.countModels(b) == bin(table).count("1")
+
+    # A random binary connective, as a truth-table for APPLY and as a
+    # function on the truth-tables of the operands.
+
+    def randomConnective(rng,names):
+        full = (1 << (1 << len(names))) - 1
+        return rng.choice([(AND,lambda t1,t2 : t1 & t2),
+                           (OR,lambda t1,t2 : t1 | t2),
+                           (XOR,lambda t1,t2 : t1 ^ t2),
+                           (EQVI,lambda t1,t2 : full ^ t1 ^ t2),
+                           (IMPL,lambda t1,t2 : (full ^ t1) | t2)])
+
+    # Reordering: random functions, half of them referenced, and the
+    # chain of X_i <-> Y_i with all X_i before all Y_i, keep their
+    # truth-tables and model-counts through reorder(), and new OBDDs
+    # built after reordering are correct. Without
+    # 'gcThreshold', the unreferenced OBDDs must survive reordering,
+    # and with it, they are not used after reordering.
+
+    names = [ "X" + str(i) for i in range(0,3) ] + [ "Y" + str(i) for i in range(0,3) ]
+    for gcThreshold in [None,0.5]:
+        rng = random.Random(1)
+        BDD = OBDD(names,gcThreshold=gcThreshold)
+        BDD.gcMinNodes = 0
+        functions = [ (BDD.ref(BDD.atom(v)),atomTable(i,names)) for i,v in enumerate(names) ]
+        full = (1 << (1 << len(names))) - 1
+        chain,chainTable = 1,full
+        for i in range(0,3):
+            (x,tx),(y,ty) = functions[i],functions[i+3]
+            b = BDD.ref(BDD.conj(chain,BDD.eqvi(x,y)))
+            BDD.deref(chain)
+            chain,chainTable = b,chainTable & (full ^ tx ^ ty)
+        unreferenced = []
+        for rounds in range(0,2):
+            for i in range(0,60):
+                (b1,t1),(b2,t2) = rng.choice(functions),rng.choice(functions)
+                f,g = randomConnective(rng,names)
+                b,t = BDD.apply(f,b1,b2),g(t1,t2)
+                if rng.random() < 0.5:
+                    b,t = BDD.neg(b),full ^ t
+                check(BDD,b,t,names)
+                if rng.random() < 0.5:
+                    functions.append((BDD.ref(b),t))
+                else:
+                    unreferenced.append((b,t))
+            if gcThreshold is not None:
+                unreferenced = []
+            BDD.reorder()
+            assert sorted(BDD.vars) == sorted(names)
+            for b,t in functions + unreferenced + [(chain,chainTable)]:
+                check(BDD,b,t,names)
+
+    # Garbage collection: random functions are built from intermediate
+    # OBDDs that are not referenced, and some of the referenced ones
+    # are dereferenced again, so that automatic collection frees nodes,
+    # and their indices are reused for new nodes. Every new OBDD, and
+    # all referenced OBDDs after each collection, keep their truth-
+    # tables and model-counts. The operations are then repeated, so
+    # that stale computed table entries would give wrong results.
+
+    names = [ "V" + str(i) for i in range(0,8) ]
+    full = (1 << (1 << len(names))) - 1
+    for cachePolicy in ["lru","direct"]:
+        rng = random.Random(2)
+        BDD = OBDD(names,cacheSize=1 << 12,cachePolicy=cachePolicy,gcThreshold=0.3)
+        BDD.gcMinNodes = 0
+        atoms = [ (BDD.ref(BDD.atom(v)),atomTable(i,names)) for i,v in enumerate(names) ]
+        functions = []
+        steps = []
+        for i in range(0,400):
+            pool = atoms + functions
+            (b1,t1),(b2,t2),(b3,t3) = rng.choice(pool),rng.choice(pool),rng.choice(pool)
+            (f1,g1),(f2,g2) = randomConnective(rng,names),randomConnective(rng,names)
+            b = BDD.apply(f2,BDD.neg(BDD.apply(f1,b1,b2)),b3)
+            t = g2(full ^ g1(t1,t2),t3)
+            check(BDD,b,t,names)
+            steps.append((f1,f2,(b1,t1),(b2,t2),(b3,t3),t))
+            if rng.random() < 0.5:
+                functions.append((BDD.ref(b),t))
+            if functions and rng.random() < 0.3:
+                b,t = functions.pop(rng.randrange(0,len(functions)))
+                BDD.deref(b)
+            if i % 100 == 99:
+                BDD.collect()
+        for b,t in atoms + functions:
+            check(BDD,b,t,names)
+        referenced = set(atoms + functions)
+        for f1,f2,(b1,t1),(b2,t2),(b3,t3),t in steps:
+            if {(b1,t1),(b2,t2),(b3,t3)} <= referenced:
+                check(BDD,BDD.apply(f2,BDD.neg(BDD.apply(f1,b1,b2)),b3),t,names)
+        assert BDD.gcRuns > 4 and BDD.freedNodes > len(BDD.freeNodes)
+
+    # The truth-table of t with each variable names[i] with i in 'subst'
+    # replaced by the function with the truth-table subst[i]
+
+    def substituteTable(t,names,subst):
+        table = 0
+        for k in range(0,1 << len(names)):
+            k2 = k
+            for i,s in subst.items():
+                k2 = (k2 & ~(1 << i)) | (((s >> k) & 1) << i)
+            if (t >> k2) & 1:
+                table |= 1 << k
+        return table
+
+    # restrict, compose and vector_compose: random functions, assignments
+    # and substitutions, each query made twice, so that the second one
+    # comes from the computed table. With 'gcThreshold', only some of
+    # the results are referenced, and the nodes of the others are freed
+    # and reused, so that stale cached results would be wrong.
+
+    names = [ "V" + str(i) for i in range(0,6) ]
+    full = (1 << (1 << len(names))) - 1
+    for gcThreshold in [None,0.3]:
+        rng = random.Random(3)
+        BDD = OBDD(names,cacheSize=1 << 10,gcThreshold=gcThreshold)
+        BDD.gcMinNodes = 0
+        functions = [ (BDD.ref(BDD.atom(v)),atomTable(i,names)) for i,v in enumerate(names) ]
+        for i in range(0,300):
+            (b1,t1),(b2,t2) = rng.choice(functions),rng.choice(functions)
+            f,g = randomConnective(rng,names)
+            b,t = BDD.apply(f,b1,b2),g(t1,t2)
+            check(BDD,b,t,names)
+            if rng.random() < 0.3:
+                functions.append((BDD.ref(b),t))
+            (b,t),(b1,t1),(b2,t2) = rng.choice(functions),rng.choice(functions),rng.choice(functions)
+            assigned = rng.sample(range(0,len(names)),rng.randrange(0,4))
+            assignment = { names[j] : rng.random() < 0.5 for j in assigned }
+            restricted = substituteTable(t,names,{ j : full if assignment[names[j]] else 0 for j in assigned })
+            j1,j2 = rng.sample(range(0,len(names)),2)
+            for repeat in range(0,2):
+                check(BDD,BDD.restrict(b,assignment),restricted,names)
+                check(BDD,BDD.compose(b,names[j1],b1),substituteTable(t,names,{ j1 : t1 }),names)
+                check(BDD,BDD.vector_compose(b,{ names[j1] : b1, names[j2] : b2 }),substituteTable(t,names,{ j1 : t1, j2 : t2 }),names)
+        if gcThreshold is not None:
+            assert BDD.gcRuns > 0
+
+    # countModelsBatch: the count for each row of random assumptions, on
+    # random subsets of the variables in random orders, is the number
+    # of assignments in the truth-table that agree with the row. Also
+    # checked are a single query as a vector, an empty list of
+    # variables, and the rejection of entries other than -1, 0 and 1.
+    # NumPy is optional, and without it this is skipped.
+
+    try:
+        import numpy
+    except ImportError:
+        numpy = None
+
+    def agreeing(t,names,vars,row):
+        count = 0
+        for k in range(0,1 << len(names)):
+            if (t >> k) & 1 and all([ a == 0 or (a == 1) == bool((k >> names.index(v)) & 1) for v,a in zip(vars,row) ]):
+                count += 1
+        return count
+
+    if numpy is not None:
+        names = [ "V" + str(i) for i in range(0,6) ]
+        rng = random.Random(4)
+        BDD = OBDD(names)
+        functions = [ (BDD.atom(v),atomTable(i,names)) for i,v in enumerate(names) ]
+        for i in range(0,40):
+            (b1,t1),(b2,t2) = rng.choice(functions),rng.choice(functions)
+            f,g = randomConnective(rng,names)
+            b,t = BDD.apply(f,b1,b2),g(t1,t2)
+            functions.append((b,t))
+            vars = rng.sample(names,rng.randrange(0,len(names)+1))
+            rows = [ [ rng.choice([-1,0,1]) for v in vars ] for q in range(0,8) ]
+            assert list(BDD.countModelsBatch(b,rows,vars)) == [ agreeing(t,names,vars,row) for row in rows ]
+            assert list(BDD.countModelsBatch(b,rows[0],vars)) == [ agreeing(t,names,vars,rows[0]) ]
+            assert list(BDD.countModelsBatch(b,[[]],[])) == [ BDD.countModels(b) ]
+            try:
+                BDD.countModelsBatch(b,[[2] * len(names)])
+                assert False
+            except ValueError:
+                pass
+
+    # Saving and loading: random functions and the terminals FALSE and
+    # TRUE are saved, and keep their truth-tables and model-counts when
+    # loaded with loadOBDD, when loaded into a manager with a permuted
+    # ordering (with ite), and when read through MappedOBDD.
+
+    import os
+    import tempfile
+
+    names = [ "V" + str(i) for i in range(0,6) ]
+    full = (1 << (1 << len(names))) - 1
+    rng = random.Random(5)
+    BDD = OBDD(names)
+    functions = [ (0,0),(1,full) ] + [ (BDD.atom(v),atomTable(i,names)) for i,v in enumerate(names) ]
+    for i in range(0,30):
+        (b1,t1),(b2,t2) = rng.choice(functions),rng.choice(functions)
+        f,g = randomConnective(rng,names)
+        functions.append((BDD.apply(f,b1,b2),g(t1,t2)))
+    roots = [ b for b,t in functions ]
+    tables = [ t for b,t in functions ]
+    permuted = list(names)
+    while permuted == names:
+        rng.shuffle(permuted)
+    with tempfile.TemporaryDirectory() as directory:
+        filename = os.path.join(directory,"test.obdd")
+        BDD.save(filename,roots)
+        BDD2,loaded = loadOBDD(filename)
+        assert BDD2.vars == names
+        for b,t in zip(loaded,tables):
+            check(BDD2,b,t,names)
+        BDD3 = OBDD(permuted)
+        for b,t in zip(BDD3.load(filename),tables):
+            check(BDD3,b,t,names)
+        with MappedOBDD(filename) as mapped:
+            assert mapped.vars == names and len(mapped.roots) == len(roots)
+            for b,r,t in zip(mapped.roots,roots,tables):
+                assert mapped.countModels(b) == BDD.countModels(r)
+                for k in range(0,1 << len(names)):
+                    assignment = { v : (k >> i) & 1 == 1 for i,v in enumerate(names) }
+                    assert mapped.evaluate(b,assignment) == ((t >> k) & 1 == 1)
     exit()
     BDD.show(BDD.conjs([]),"TRUE.png")
     BDD.show(BDD.disjs([]),"FALSE.png")
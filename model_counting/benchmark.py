@@ -0,0 +1,49 @@
+# Benchmarks for the OBDD package in bddops-template.py
+#
+# Compares the recursive APPLY (applyRecursive) to the APPLY with an
+# explicit stack (apply), by building the conjunction of X_i <-> Y_i
+# for i = 0..n-1 with X_i and Y_i next to each other in the ordering.
+# The recursion depth of APPLY is the number of variables, so for large
+# n the recursive version runs out of stack.
+#
+# To run, write e.g.
+#
+#   python3 benchmark.py 100 300 1000
+
+import sys
+import timeit
+
+from loadbddops import loadOBDDmodule
+
+bddops = loadOBDDmodule()
+
+# Minimum, median and maximum of a list of numbers
+
+def min_med_max(data):
+    data = sorted(data)
+    return (data[0],data[len(data) // 2],data[-1])
+
+# Build the chain of equivalences with the given APPLY method of OBDD.
+
+def chain(n,applyMethod):
+    BDD = bddops.OBDD([ f(i) for i in range(0,n) for f in (lambda x : "X" + str(x), lambda y : "Y" + str(y)) ])
+    apply = applyMethod.__get__(BDD)
+    b = 1
+    for i in range(0,n):
+        e = apply(bddops.EQVI,BDD.atom("X" + str(i)),BDD.atom("Y" + str(i)))
+        b = apply(bddops.AND,b,e)
+    return BDD,b
+
+def benchmark(n,repeats=3):
+    print("n = " + str(n) + " (" + str(2*n) + " variables)")
+    for name,method in [("recursive",bddops.OBDD.applyRecursive),("iterative",bddops.OBDD.apply)]:
+        try:
+            res = timeit.repeat(lambda : chain(n,method),repeat=repeats,number=1)
+            print("  %-10s [min,med,max] in seconds: [%.3f,%.3f,%.3f]" % ((name,) + min_med_max(res)))
+        except RecursionError:
+            print("  %-10s RecursionError" % name)
+
+if __name__ == "__main__":
+    sizes = [ int(a) for a in sys.argv[1:] ] or [100,300,1000]
+    for n in sizes:
+        benchmark(n)
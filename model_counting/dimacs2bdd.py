@@ -0,0 +1,230 @@
+#!/usr/bin/python3
+
+# Compile a CNF in the DIMACS format into an OBDD, and output
+# its exact model-count.
+#
+# To run, write e.g.
+#
+#   python3 dimacs2bdd.py instance.cnf
+#   python3 dimacs2bdd.py instance.cnf minfill
+#
+# The optional second argument is the variable ordering heuristic:
+#    force   : the FORCE heuristic (default)
+#    minfill : reversed min-fill elimination order
+#    natural : variables 1,2,3,... in order, with the clauses
+#              compiled as they are read, without storing them
+
+import sys
+import heapq
+
+from loadbddops import loadOBDDmodule
+
+bddops = loadOBDDmodule()
+
+# Read a DIMACS CNF file.
+#
+# Returns the number of variables and the number of clauses from the
+# 'p cnf' header line, and a generator of the clauses, each a tuple
+# of non-zero integers (negative for negative literals). The clauses
+# are read from the file only as the generator is consumed. A clause
+# may span several lines, and is terminated by 0. Variables larger
+# than the number of variables in the header are reported as errors.
+
+def readDIMACS(f):
+    for line in f:
+        tokens = line.split()
+        if not tokens or tokens[0] == "c":
+            continue
+        if tokens[0] == "p":
+            if len(tokens) != 4 or tokens[1] != "cnf":
+                raise ValueError("bad DIMACS header: " + line.strip())
+            nvars = int(tokens[2])
+            return nvars,int(tokens[3]),readClauses(f,nvars)
+        raise ValueError("DIMACS header missing before: " + line.strip())
+    raise ValueError("DIMACS header missing")
+
+def readClauses(f,nvars):
+    clause = []
+    for line in f:
+        tokens = line.split()
+        if not tokens or tokens[0] == "c":
+            continue
+        if tokens[0] == "%": # End marker used in some benchmark files
+            break
+        for t in tokens:
+            lit = int(t)
+            if lit == 0:
+                yield tuple(clause)
+                clause = []
+            elif abs(lit) > nvars:
+                raise ValueError("variable " + str(abs(lit)) + " not declared in the header")
+            else:
+                clause.append(lit)
+    if clause:
+        yield tuple(clause)
+
+# Variable ordering heuristics
+#
+# Both take the number of variables and the list of clauses, and
+# return the variables 1..nvars as a list in the order of the OBDD.
+
+# FORCE (Aloul, Markov and Sakallah 2003): each clause is placed at
+# the center of gravity of its variables, each variable is moved to
+# the average center of gravity of its clauses, and the variables are
+# sorted by their new positions. This is repeated while the total
+# span of the clauses decreases.
+
+def forceOrder(nvars,clauses,maxIterations=50):
+    occurrences = [ [] for v in range(0,nvars+1) ]
+    for i,clause in enumerate(clauses):
+        for lit in clause:
+            occurrences[abs(lit)].append(i)
+
+    def span(pos):
+        total = 0
+        for clause in clauses:
+            positions = [ pos[abs(lit)] for lit in clause ]
+            total += max(positions) - min(positions)
+        return total
+
+    order = list(range(1,nvars+1))
+    pos = [0] * (nvars+1)
+    for i,v in enumerate(order):
+        pos[v] = i
+    bestOrder = order
+    bestSpan = span(pos)
+    for iteration in range(0,maxIterations):
+        cog = [ sum([ pos[abs(lit)] for lit in clause ]) / len(clause) for clause in clauses ]
+        newPos = [ sum([ cog[i] for i in occurrences[v] ]) / len(occurrences[v]) if occurrences[v] else pos[v] for v in range(0,nvars+1) ]
+        order = sorted(range(1,nvars+1),key=lambda v : newPos[v])
+        for i,v in enumerate(order):
+            pos[v] = i
+        s = span(pos)
+        if s >= bestSpan:
+            break
+        bestOrder = order
+        bestSpan = s
+    return bestOrder
+
+# Min-fill: variables of the primal graph (two variables are adjacent
+# if they occur in the same clause) are eliminated greedily, always
+# choosing the variable whose elimination adds the fewest edges between
+# its neighbours. The fill values are kept in a priority queue, and only
+# those of the neighbours of the eliminated variable are recomputed.
+# The last eliminated variable comes first in the OBDD.
+
+def minfillOrder(nvars,clauses):
+    neighbours = [ set() for v in range(0,nvars+1) ]
+    for clause in clauses:
+        vs = { abs(lit) for lit in clause }
+        for v in vs:
+            neighbours[v].update(vs)
+    for v in range(1,nvars+1):
+        neighbours[v].discard(v)
+
+    def fill(v):
+        ns = list(neighbours[v])
+        missing = 0
+        for i in range(0,len(ns)):
+            for j in range(i+1,len(ns)):
+                if ns[j] not in neighbours[ns[i]]:
+                    missing += 1
+        return missing
+
+    current = [ fill(v) for v in range(0,nvars+1) ]
+    queue = [ (current[v],len(neighbours[v]),v) for v in range(1,nvars+1) ]
+    heapq.heapify(queue)
+    eliminated = [False] * (nvars+1)
+    elimination = []
+    while queue:
+        f,_,v = heapq.heappop(queue)
+        if eliminated[v] or f != current[v]:
+            continue
+        eliminated[v] = True
+        elimination.append(v)
+        ns = neighbours[v]
+        for u in ns:
+            neighbours[u].discard(v)
+            neighbours[u].update(ns)
+            neighbours[u].discard(u)
+        for u in ns:
+            current[u] = fill(u)
+            heapq.heappush(queue,(current[u],len(neighbours[u]),u))
+    return list(reversed(elimination))
+
+# OBDD for a clause, built directly from the deepest literal upwards.
+# Returns TRUE for clauses with complementary literals.
+
+def clauseBDD(BDD,clause):
+    literals = dict()
+    for lit in clause:
+        if str(abs(lit)) not in BDD.varIndex:
+            raise ValueError("variable " + str(abs(lit)) + " not declared in the header")
+        var = BDD.varIndex[str(abs(lit))]
+        if literals.get(var,lit > 0) != (lit > 0):
+            return 1
+        literals[var] = lit > 0
+    b = 0
+    for var in sorted(literals,reverse=True):
+        if literals[var]:
+            b = BDD.newOBDDnode(var,1,b)
+        else:
+            b = BDD.newOBDDnode(var,b,1)
+    return b
+
+# Schedule the clauses bottom-up: clauses whose variables are deepest
+# in the ordering come first, and among clauses with the same top
+# variable, those with the shortest span of variables come first.
+
+def scheduleClauses(BDD,clauses):
+    def key(clause):
+        levels = [ BDD.varIndex[str(abs(lit))] for lit in clause ]
+        return (-min(levels),max(levels) - min(levels))
+    return sorted(clauses,key=key)
+
+# Compile a CNF into an OBDD. Returns the OBDD manager and the OBDD,
+# which is referenced. 'order' is the ordering heuristic, and 'mode'
+# the chain conjunction mode (see OBDD.conjs).
+
+def compileCNF(nvars,clauses,order="force",mode="left"):
+    if order == "natural":
+        BDD = bddops.OBDD([ str(v) for v in range(1,nvars+1) ],gcThreshold=0.5)
+        b = BDD.ref(1)
+        for clause in clauses:
+            c = BDD.ref(clauseBDD(BDD,clause))
+            b2 = BDD.ref(BDD.conj(b,c))
+            BDD.deref(b)
+            BDD.deref(c)
+            b = b2
+        return BDD,b
+    clauses = list(clauses)
+    if () in clauses:
+        return bddops.OBDD([ str(v) for v in range(1,nvars+1) ]),0
+    if order == "force":
+        vars = forceOrder(nvars,clauses)
+    elif order == "minfill":
+        vars = minfillOrder(nvars,clauses)
+    else:
+        raise ValueError("unknown ordering heuristic: " + str(order))
+    BDD = bddops.OBDD([ str(v) for v in vars ],gcThreshold=0.5)
+    bb = [ clauseBDD(BDD,clause) for clause in scheduleClauses(BDD,clauses) ]
+    return BDD,BDD.ref(BDD.conjs(bb,mode))
+
+# Main procedure for reading the input file and counting the models
+
+def main():
+    if len(sys.argv) not in [2,3]:
+        print("Usage: dimacs2bdd.py file [force|minfill|natural]")
+        exit(1)
+    filename = sys.argv[1]
+    order = sys.argv[2] if len(sys.argv) == 3 else "force"
+    print("Input file: " + filename)
+    with open(filename) as f:
+        nvars,nclauses,clauses = readDIMACS(f)
+        print("Variables: " + str(nvars) + " Clauses: " + str(nclauses))
+        BDD,b = compileCNF(nvars,clauses,order)
+        print("OBDD size: " + str(BDD.size(b)))
+        print("Model count: " + str(BDD.countModels(b)))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,19 @@
+# Loading of the OBDD package in bddops-template.py
+#
+# The module name has a dash, so it is loaded from its file name. It
+# is loaded once, and registered as the module 'bddops', so that all
+# scripts that load it share the same module.
+
+import os
+import sys
+import importlib.util
+
+def loadOBDDmodule():
+    if "bddops" in sys.modules:
+        return sys.modules["bddops"]
+    filename = os.path.join(os.path.dirname(os.path.abspath(__file__)),"bddops-template.py")
+    spec = importlib.util.spec_from_file_location("bddops",filename)
+    module = importlib.util.module_from_spec(spec)
+    sys.modules["bddops"] = module
+    spec.loader.exec_module(module)
+    return module
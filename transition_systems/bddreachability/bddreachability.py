@@ -1,15 +1,64 @@
 #!/usr/bin/python3
 
-import sys
+import time
+import argparse
 from logic import *
 from ground import groundmodel
 from model2logic import model2logic,transition2logic
 from specparser import parseinputfile
+from ordering import variablegroups,forceorder,siftpairs
+from trans2bdd import identityrelation,transition2bdd
 
 #import dd.cudd as _bdd
 from dd import autoref as _bdd
 
-def reachability(source,target,transitions,allstatevars):
+# The transition relation is represented either as one BDD for the
+# disjunction of all transitions ("monolithic"), or as a list of
+# clusters ("partitioned"), each the disjunction of some transitions.
+# The image of a set of states is then the union of the images by the
+# clusters, so that the conjunction with the whole relation is never
+# built. A cluster is closed when its BDD would have more than
+# 'clustersize' nodes.
+#
+# With 'frontier', each step computes the image of the frontier, the
+# states reached in the previous step for the first time, instead of
+# all states reached so far. Any set between the frontier and all of
+# the reached states gives the same result, so the set with the
+# smallest BDD among the frontier, the image computed in the previous
+# step and all reached states is used.
+#
+# With 'fused', images and preimages are computed with the relational
+# product of dd (_bdd.image and _bdd.preimage), which quantifies the
+# variables during the conjunction, so that the conjunction of the
+# transition relation and the states is never built. Otherwise the
+# conjunction is built first, and the variables are quantified from it.
+# The relational product of dd needs x and x' next to each other in
+# the ordering, so with the bad ordering images are always unfused.
+# The largest number of nodes in the BDD manager right after an image
+# or preimage is reported at the end.
+#
+# 'layers' and 'checkpoint' are for the storage of the layers of the
+# search (see store below). 'checkpoint' must be at least 1.
+#
+# 'order' is the variable ordering (see below). If 'reorderbudget' is
+# positive, the variables are also reordered dynamically, in pairs of
+# x and x', after the transition relation has been built and whenever
+# the number of nodes has doubled since the last reordering, until
+# reordering has taken 'reorderbudget' seconds in total.
+#
+# With 'builder' "direct", the BDDs for the transitions are built
+# directly from the grounded transitions (see trans2bdd.py), and with
+# "formula", from their formulas as given by model2logic.py.
+#
+# 'direction' is the direction of the search (see below), and 'engine'
+# is "bfs" for breadth-first search, or "chaining" for chaining (see
+# below), which is only forward, and finds a transition sequence
+# that need not be the shortest.
+
+def reachability(source,target,transitions,allstatevars,relation="monolithic",clustersize=1000,frontier=False,fused=True,layers="all",checkpoint=8,order="force",reorderbudget=0,builder="direct",direction="forward",engine="bfs"):
+
+    if checkpoint < 1:
+        raise ValueError("checkpoint must be at least 1, not " + str(checkpoint))
 
     # Create a BDD
 
@@ -44,6 +93,13 @@ def reachability(source,target,transitions,allstatevars):
     for v in allstatevars:
         goodorder.extend([CURRENT(v),NEXT(v)])
 
+    #  FORCE ordering also has x and x' next to each other, and state
+    #  variables occurring in the same transitions close to each other
+
+    staticorder = list()
+    for v in forceorder(allstatevars,variablegroups(target,transitions)):
+        staticorder.extend([CURRENT(v),NEXT(v)])
+
     #  Bad ordering has all "current" variables before all "next" variables
 
     badorder = list(allstatevars)
@@ -55,10 +111,36 @@ def reachability(source,target,transitions,allstatevars):
     def list_to_dict(c):
         return {var: level for level, var in enumerate(c)}
 
-    # Deploy variable ordering (choose either the good or bad ordering here!)
+    # Deploy variable ordering (choose the good, bad or FORCE ordering with 'order')
+
+    if order == "good":
+        _bdd.reorder(bdd,list_to_dict(goodorder))
+    elif order == "bad":
+        _bdd.reorder(bdd,list_to_dict(badorder))
+    else:
+        _bdd.reorder(bdd,list_to_dict(staticorder))
+
+    # The fused image and preimage of dd only work when every x is next
+    # to x' in the ordering. Dynamic reordering keeps them together.
+
+    if fused and any([ abs(bdd.level_of_var(CURRENT(v)) - bdd.level_of_var(NEXT(v))) != 1 for v in allstatevars ]):
+        print("Variables x and x' are not adjacent: images are not fused")
+        fused = False
+
+    # Dynamic reordering within the remaining time budget
 
-    _bdd.reorder(bdd,list_to_dict(goodorder))
-#    _bdd.reorder(bdd,list_to_dict(badorder))
+    pairs = [ (CURRENT(v),NEXT(v)) for v in allstatevars ]
+    budget = reorderbudget
+    reordered = 0 # Number of nodes after the last reordering
+
+    def maybereorder():
+        nonlocal budget,reordered
+        if budget <= 0 or len(bdd) < 2 * reordered:
+            return
+        start = time.time()
+        reordered = siftpairs(bdd,pairs,budget)
+        budget -= time.time() - start
+        print("Reordered: " + str(reordered) + " nodes")
 
     # Create mappings x => x' and x' => x (needed for image operations)
     
@@ -75,7 +157,8 @@ def reachability(source,target,transitions,allstatevars):
         n,c,e = t
         return (n,transition2logic(t,allstatevars)) # Keep name
 
-    transfmas = [ trans2logic(t) for t in transitions ]
+    if builder == "formula":
+        transfmas = [ trans2logic(t) for t in transitions ]
 
     # Translate atoms (x,0) (current value of x)
     # and (x,1) (new value of x) to BDD variables
@@ -95,14 +178,113 @@ def reachability(source,target,transitions,allstatevars):
 
     print("Constructing BDD for the transition relation")
 
-    transitionbdds = [ (n,f.atommap(atom4bdd).makeBDD(bdd)) for n,f in transfmas ]
+    # BDDs of subformulas shared by the transitions (see logic.py)
+
+    formulacache = dict()
+
+    if builder == "formula":
+        transitionbdds = [ (n,f.atommap(atom4bdd).makeBDD(bdd,formulacache)) for n,f in transfmas ]
+    else:
+        identity = identityrelation(bdd,allstatevars,CURRENT,NEXT)
+        transitionbdds = [ (t[0],transition2bdd(bdd,t,identity,CURRENT,NEXT,formulacache)) for t in transitions ]
+
+    if engine == "chaining":
+
+        # Chaining images by one transition at a time, so neither the
+        # relation nor its clusters are needed
+
+        print("Transition relation not built: " + str(len(transitionbdds)) + " transitions of sizes up to " + str(max([ len(t) for n,t in transitionbdds ],default=0)))
+
+    elif relation == "monolithic":
+
+        # Build BDD for the relation for all transitions
+
+        if builder == "formula":
+            transrelation = model2logic(source,target,transitions,allstatevars)
+            transbdd = transrelation.atommap(atom4bdd).makeBDD(bdd,formulacache)
+        else:
+            transbdd = bdd.false
+            for n,t in transitionbdds:
+                transbdd = bdd.apply('or',transbdd,t)
+
+        print("Transition relation completed: size " + str(len(transbdd)))
+
+        partitions = [transbdd]
+
+    else:
+
+        # Group the transitions into clusters
+
+        partitions = []
+        cluster = bdd.false
+        for n,t in transitionbdds:
+            bigger = bdd.apply('or',cluster,t)
+            if cluster != bdd.false and len(bigger) > clustersize:
+                partitions.append(cluster)
+                cluster = t
+            else:
+                cluster = bigger
+        partitions.append(cluster)
+
+        print("Transition relation completed: " + str(len(partitions)) + " clusters of sizes " + ' '.join([ str(len(c)) for c in partitions ]))
 
-    # Build BDD for the relation for all transitions
+    del formulacache
 
-    transrelation = model2logic(source,target,transitions,allstatevars)
-    transbdd = transrelation.atommap(atom4bdd).makeBDD(bdd)
+    maybereorder()
 
-    print("Transition relation completed: size " + str(len(transbdd)))
+    # Largest number of nodes seen after an image or preimage
+
+    peak = 0
+
+    def observe():
+        nonlocal peak
+        peak = max(peak,len(bdd))
+
+    # All states reachable from 'states' by the relation 't'
+
+    def post(t,states):
+        if fused:
+            result = _bdd.image(t,states,new2old,set(oldvars))
+            observe()
+        else:
+            conj = bdd.apply('and',t,states)
+            observe()
+            result = bdd.let(new2old,bdd.exist(oldvars,conj))
+        return result
+
+    # All states from which 'states' is reachable by the relation 't'
+
+    def pre(t,states):
+        if fused:
+            result = _bdd.preimage(t,states,old2new,set(newvars))
+            observe()
+        else:
+            conj = bdd.apply('and',t,bdd.let(old2new,states))
+            observe()
+            result = bdd.exist(newvars,conj)
+        return result
+
+    # All states reachable from 'states' by one step, and all states
+    # from which 'states' is reachable by one step:
+    # the unions of the images and preimages by every partition
+    # In post, _bdd.image is for the relational product: conjunction
+    #          with Existential Abstraction, and the renaming new2old,
+    #          or, if not fused,
+    #          bdd.let is for applying the renaming new2old to a BDD,
+    #          bdd.exist is for Existential Abstraction
+    #          bdd.apply is the Apply operation for doing conjunction/and
+
+    def image(states):
+        newstates = bdd.false
+        for c in partitions:
+            newstates = bdd.apply('or',newstates,post(c,states))
+        return newstates
+
+    def preimage(states):
+        newstates = bdd.false
+        for c in partitions:
+            newstates = bdd.apply('or',newstates,pre(c,states))
+        return newstates
     
     # Build formula for the initial state.
     # This is either
@@ -121,55 +303,252 @@ def reachability(source,target,transitions,allstatevars):
 
     initialbdd = initialfma.makeBDD(bdd)
 
-    # Symbolic breadth-first search
-    
-    S = {}
-    previousS = bdd.false
-    S[0] = initialbdd
-    i = 0
-    while S[i] != previousS and bdd.apply('and',targetbdd,S[i]) == bdd.false:
-        print("Reachability by " + str(i+1) + " transitions: ", end='')
-        # All states reachable from S[i] by one step
-        newstates = bdd.let(new2old,bdd.exist(oldvars,bdd.apply('and',transbdd,S[i])))
-        # Above, bdd.let is for applying the renaming new2old to a BDD,
-        #        bdd.exist is for Existential Abstraction
-        #        bdd.apply is the Apply operation for doing conjunction/and
+    # Symbolic breadth-first search, forward from the initial states
+    # with images, or backward from the target states with preimages.
+    # A search is a dictionary with
+    #   "name"     : the name of the search in the output
+    #   "step"     : image or preimage (None with chaining)
+    #   "i"        : the number of steps so far
+    #   "current"  : the states reached in at most i steps, S[i]
+    #   "previous" : the states reached in at most i-1 steps
+    #   "frontier" : the states to take the next step from (see above)
+    #   "stored"   : the stored layers (see store)
+    #   "applied"  : for each step, the transition (n,t) applied in it by
+    #                chaining, or None if the step was taken with "step"
+
+    def newsearch(name,step,start):
+        search = { "name" : name, "step" : step, "i" : 0, "current" : start,
+                   "previous" : bdd.false, "frontier" : start, "stored" : {},
+                   "applied" : [] }
+        store(search)
+        return search
+
+    # Storage of the layers S[j] of a search, which are needed for
+    # extracting the transition sequence at the end:
+    #   "all"        : every layer S[j]
+    #   "onion"      : the rings S[j] - S[j-1] only, from which the layers
+    #                  are recovered backwards as S[j-1] = S[j] - ring j
+    #   "checkpoint" : every 'checkpoint'th layer only, from which the
+    #                  layers in between are recomputed with images
+    # In all cases the layers are the same, and so is the sequence.
+
+    def store(search):
+        j = search["i"]
+        if layers == "all" or (layers == "checkpoint" and j % checkpoint == 0):
+            search["stored"][j] = search["current"]
+        elif layers == "onion":
+            search["stored"][j] = bdd.apply('diff',search["current"],search["previous"])
+
+    # The layers S[i-1], S[i-2], ..., S[0] of a search
+
+    def layersbackwards(search):
+        stored = search["stored"]
+        Si = search["current"]
+        recomputed = {}
+        for j in range(search["i"]-1,-1,-1):
+            if layers == "all":
+                yield stored[j]
+            elif layers == "onion":
+                Si = bdd.apply('diff',Si,stored[j+1])
+                yield Si
+            else:
+                if j not in recomputed:
+                    c = j - j % checkpoint
+                    recomputed = { c : stored[c] }
+                    for m in range(c,j):
+                        if search["applied"][m] is None:
+                            newstates = search["step"](recomputed[m])
+                        else:
+                            newstates = post(search["applied"][m][1],recomputed[m])
+                        recomputed[m+1] = bdd.apply('or',recomputed[m],newstates)
+                yield recomputed.pop(j)
+
+    # One step of a search
+
+    def advance(search):
+        current = search["current"]
+        print(search["name"] + " by " + str(search["i"]+1) + " transitions: ", end='')
+        # All states reachable from S[i] (or from the frontier) by one step
+        if frontier:
+            newstates = search["step"](search["frontier"])
+        else:
+            newstates = search["step"](current)
         # S[i+1] = S[i] U newstates
-        S[i+1] = bdd.apply('or',S[i],newstates)
-        print(str(S[i+1].count(nvars = len(allstatevars))) + " states with BDD size " + str(len(S[i+1])))
-        previousS = S[i]
-        i = i + 1
+        nextS = bdd.apply('or',current,newstates)
+        if frontier:
+            search["frontier"] = min([ bdd.apply('diff',nextS,current), newstates, nextS ],key=len)
+        else:
+            search["frontier"] = nextS
+        print(str(nextS.count(nvars = len(allstatevars))) + " states with BDD size " + str(len(nextS)))
+        search["previous"] = current
+        search["current"] = nextS
+        search["i"] += 1
+        search["applied"].append(None)
+        store(search)
+        maybereorder()
+
+    # Chaining, forward from the initial states. In each round, every
+    # transition is applied until no new states are reached, before the
+    # next transition. The transitions are taken in the order of their
+    # topmost variables, starting from the bottom of the BDD, as in
+    # saturation. After the first application of a transition, only the
+    # states that it reached last time need to be imaged. Each
+    # application is a step of the search, with its own layer.
+
+    def chaining(search):
+        def toplevel(nt):
+            return min([ bdd.level_of_var(v) for v in bdd.support(nt[1]) ],default=0)
+        ordered = sorted(transitionbdds,key=toplevel,reverse=True)
+        round = 0
+        while True:
+            round += 1
+            start = search["current"]
+            for nt in ordered:
+                todo = search["current"]
+                while True:
+                    current = search["current"]
+                    nextS = bdd.apply('or',current,post(nt[1],todo))
+                    if nextS == current:
+                        break
+                    todo = bdd.apply('diff',nextS,current)
+                    search["previous"] = current
+                    search["current"] = nextS
+                    search["i"] += 1
+                    search["applied"].append(nt)
+                    store(search)
+                    if met():
+                        return
+            print("Chaining round " + str(round) + ": " + str(search["current"].count(nvars = len(allstatevars))) + " states with BDD size " + str(len(search["current"])))
+            if search["current"] == start:
+                search["previous"] = start
+                return
+            maybereorder()
+
+    # 'direction' is "forward", "backward", or "bidirectional", which
+    # alternates between the directions, always taking the step from
+    # the smaller frontier, until the searches meet. A search that
+    # does not take any steps is just the initial or target states.
+
+    if engine == "chaining":
+        forward = newsearch("Reachability",None,initialbdd)
+        backward = newsearch("Backward reachability",None,targetbdd)
+    else:
+        forward = newsearch("Reachability",image,initialbdd)
+        backward = newsearch("Backward reachability",preimage,targetbdd)
+
+    def met():
+        return bdd.apply('and',forward["current"],backward["current"]) != bdd.false
+
+    def fixpoint(search):
+        return search["current"] == search["previous"]
+
+    if engine == "chaining":
+        if not met():
+            chaining(forward)
+    else:
+        while not met() and not fixpoint(forward) and not fixpoint(backward):
+            if direction == "forward":
+                advance(forward)
+            elif direction == "backward":
+                advance(backward)
+            else:
+                advance(min([forward,backward],key=lambda search : len(search["frontier"])))
     # Search ends: target reached, or, all states reached
-    if S[i] == previousS:
+    if not met():
         print("Target states not reachable")
+    elif engine == "chaining":
+        print("Target states reached by chaining:")
+        # Extract transition sequence names: going back through the steps,
+        # a step is skipped if T has states that were reached before it
+        T = bdd.apply('and',forward["current"],targetbdd)
+        sequence = []
+        j = forward["i"]
+        for Sprevious in layersbackwards(forward):
+            j = j-1
+            n,t = forward["applied"][j]
+            R = bdd.apply('and',T,Sprevious)
+            if R == bdd.false:
+                R = bdd.apply('and',pre(t,T),Sprevious)
+                sequence = [n] + sequence
+            T = R
+        for s in sequence:
+            print(s)
     else:
-        print("Target states reached by " + str(i) + " steps:")
-        # Extract transition sequence names
-        T = bdd.let(old2new,bdd.apply('and',S[i],targetbdd))
+        print("Target states reached by " + str(forward["i"] + backward["i"]) + " steps:")
+        # Extract transition sequence names, backwards from the states
+        # where the searches meet to the initial states, and forwards
+        # from them to the target states
+        meet = bdd.apply('and',forward["current"],backward["current"])
+        # With both parts, they must go through the same state, so one
+        # of the states is chosen
+        if forward["i"] > 0 and backward["i"] > 0:
+            meet = bdd.cube(bdd.pick(meet,care_vars=set(oldvars)))
         sequence = []
-        while i>0:
+        T = meet
+        for Sprevious in layersbackwards(forward):
             # Find transition from S[i-1] to T
             for nt in transitionbdds:
                 n,t = nt
-                R = bdd.apply('and',bdd.apply('and',T,t),S[i-1])
+                R = bdd.apply('and',pre(t,T),Sprevious)
                 if R != bdd.false:
                     sequence = [n] + sequence
-                    T = bdd.let(old2new,bdd.exist(newvars,R))
+                    T = R
+                    break
+        T = meet
+        for Sprevious in layersbackwards(backward):
+            # Find transition from T to S[i-1] of the backward search
+            for nt in transitionbdds:
+                n,t = nt
+                R = bdd.apply('and',post(t,T),Sprevious)
+                if R != bdd.false:
+                    sequence = sequence + [n]
+                    T = R
                     break
-            i = i-1
         for s in sequence:
             print(s)
+    print("Peak BDD nodes after an image or preimage: " + str(peak))
 
 # Main procedure for reading the input file and calling reachability
 def main():
-    if len(sys.argv) != 2:
-        print("Must give exactly one argument [file]")
-        exit(1)
-    args = sys.argv
-    filename = args[1]
+    argp = argparse.ArgumentParser(description='BDD-based reachability analysis of a transition system.',
+                                   formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    argp.add_argument('file',help='the transition system specification')
+    argp.add_argument('--relation',choices=['monolithic','partitioned'],default='monolithic',
+                      help='one BDD for the transition relation, or clusters of transitions')
+    argp.add_argument('--clustersize',type=int,default=1000,
+                      help='the largest BDD size of a cluster in the partitioned relation')
+    argp.add_argument('--frontier',action='store_true',
+                      help='compute the images of the newly reached states only')
+    argp.add_argument('--unfused',action='store_true',
+                      help='build the conjunction before quantification in images')
+    argp.add_argument('--layers',choices=['all','onion','checkpoint'],default='all',
+                      help='which layers of the search to store for extracting the transition sequence')
+    argp.add_argument('--checkpoint',type=int,default=8,
+                      help='store every this many layers with --layers checkpoint')
+    argp.add_argument('--order',choices=['force','good'],default='force',
+                      help='the static variable ordering')
+    argp.add_argument('--reorderbudget',type=float,default=0,
+                      help='seconds to spend in dynamic reordering (0 means none)')
+    argp.add_argument('--builder',choices=['direct','formula'],default='direct',
+                      help='build the transition BDDs directly, or from their formulas')
+    argp.add_argument('--direction',choices=['forward','backward','bidirectional'],default='forward',
+                      help='search from the initial states, from the target states, or from both')
+    argp.add_argument('--engine',choices=['bfs','chaining'],default='bfs',
+                      help='breadth-first search, or chaining of the transitions one at a time')
+    args = argp.parse_args()
+    if args.engine == 'chaining' and args.direction != 'forward':
+        argp.error('chaining is only forward')
+    if args.checkpoint < 1:
+        argp.error('--checkpoint must be at least 1')
+    filename = args.file
     print("Input file: " + filename)
     source,target,transitions = parseinputfile(filename)
     gsource,gtarget,gtransitions,allstatevars = groundmodel(source,target,transitions)
-    reachability(gsource,gtarget,gtransitions,allstatevars)
-
-main()
+    reachability(gsource,gtarget,gtransitions,allstatevars,
+                 relation=args.relation,clustersize=args.clustersize,frontier=args.frontier,
+                 fused=not args.unfused,layers=args.layers,checkpoint=args.checkpoint,
+                 order=args.order,reorderbudget=args.reorderbudget,builder=args.builder,
+                 direction=args.direction,engine=args.engine)
+
+if __name__ == "__main__":
+    main()
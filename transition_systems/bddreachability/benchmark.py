@@ -0,0 +1,62 @@
+#!/usr/bin/python3
+
+# Benchmarks for the reachability modes of bddreachability.py
+#
+# Each specification is parsed and grounded once, and reachability is
+# then run in each mode, with its output suppressed. The time includes
+# the construction of the BDDs for the transition relation. The parser
+# keeps the transitions of all files that it has read, so every file
+# is benchmarked in a separate process.
+#
+# To run, write e.g.
+#
+#   python3 benchmark.py GRIPPER06.SPEC SETBITS12.SPEC
+
+import io
+import sys
+import timeit
+import contextlib
+import subprocess
+
+from ground import groundmodel
+from specparser import parseinputfile
+from bddreachability import reachability
+
+# The modes to compare, as keyword arguments of reachability
+
+MODES = [
+    ("formula",dict(relation="monolithic",builder="formula")),
+    ("unfused",dict(relation="monolithic",fused=False)),
+    ("monolithic",dict(relation="monolithic")),
+    ("partitioned",dict(relation="partitioned")),
+    ("frontier",dict(relation="partitioned",frontier=True)),
+    ("onion",dict(relation="partitioned",frontier=True,layers="onion")),
+    ("checkpoint",dict(relation="partitioned",frontier=True,layers="checkpoint")),
+    ("backward",dict(relation="partitioned",frontier=True,direction="backward")),
+    ("bidirectional",dict(relation="partitioned",frontier=True,direction="bidirectional")),
+    ("chaining",dict(engine="chaining")),
+]
+
+def min_med_max(data):
+    data = sorted(data)
+    return (data[0],data[len(data) // 2],data[-1])
+
+def benchmark(filename,repeats=3):
+    print(filename)
+    with contextlib.redirect_stdout(io.StringIO()):
+        source,target,transitions = parseinputfile(filename)
+        gsource,gtarget,gtransitions,allstatevars = groundmodel(source,target,transitions)
+    for name,options in MODES:
+        def run():
+            with contextlib.redirect_stdout(io.StringIO()):
+                reachability(gsource,gtarget,gtransitions,allstatevars,**options)
+        res = timeit.repeat(run,repeat=repeats,number=1)
+        print("  %-14s [min,med,max] in seconds: [%.3f,%.3f,%.3f]" % ((name,) + min_med_max(res)))
+
+if __name__ == "__main__":
+    filenames = sys.argv[1:] or ["GRIPPER06.SPEC","SETBITS12.SPEC","GRID4x4.SPEC"]
+    if len(filenames) == 1:
+        benchmark(filenames[0])
+    else:
+        for filename in filenames:
+            subprocess.run([sys.executable,sys.argv[0],filename])
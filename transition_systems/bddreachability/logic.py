@@ -2,17 +2,20 @@
 
 import itertools
 
-# Helper function for iterating bdd.apply over a list
+# Helper function for iterating bdd.apply over a list of BDDs
+#
+# The BDDs are combined pairwise in a balanced tree, so that the BDDs
+# combined are of similar sizes.
 
-def applyforlist(bddop,formulas,bdd,foremptylist):
-  if len(formulas) == 0:
+def applyforlist(bddop,bdds,bdd,foremptylist):
+  if len(bdds) == 0:
     return foremptylist
-  first,rest = formulas[0], formulas[1:]
-  headbdd = first.makeBDD(bdd)
-  if len(rest) == 0:
-    return headbdd
-  tailbdd = applyforlist(bddop,rest,bdd,foremptylist)
-  return bdd.apply(bddop,headbdd,tailbdd)
+  while len(bdds) > 1:
+    pairs = [ bdd.apply(bddop,bdds[i],bdds[i+1]) for i in range(0,len(bdds)-1,2) ]
+    if len(bdds) % 2 == 1:
+      pairs.append(bdds[-1])
+    bdds = pairs
+  return bdds[0]
 
 # Representation of propositional formulas in Python.
 #
@@ -26,13 +29,43 @@ def applyforlist(bddop,formulas,bdd,foremptylist):
 #   atommap(self,M)    Formula with every AT(a) replaced by M(a)
 #   makeBDD(self,bdd)  Construct an OBDD from the formula
 #
+# makeBDD takes an optional dictionary 'cache', which hash-conses the
+# subformulas: every structurally different subformula gets its own
+# number and OBDD, so that equal subformulas, even if they are
+# different objects (for example from different calls to atommap),
+# are translated only once. The structure of a formula consists of
+# its connective and the numbers of its subformulas, so it is hashed
+# in constant time. The cache maps structures to pairs (number,OBDD).
+# Passing the same dictionary to several calls shares the OBDDs
+# between the formulas. The numbers and the OBDDs only exist as long
+# as the dictionary does.
+#
+
+class Formula:
+  def makeBDD(self,bdd,cache=None):
+    if cache is None:
+      cache = dict()
+    return self.hashcons(bdd,cache,dict())[1]
+  # The pair (number,OBDD) of the formula in 'cache'. 'seen' maps
+  # the ids of the subformulas already visited in this call to theirs.
+  def hashcons(self,bdd,cache,seen):
+    if id(self) not in seen:
+      parts = [ f.hashcons(bdd,cache,seen) for f in self.parts() ]
+      structure = self.structure([ n for n,b in parts ])
+      if structure not in cache:
+        cache[structure] = (len(cache),self.buildBDD(bdd,[ b for n,b in parts ]))
+      seen[id(self)] = cache[structure]
+    return seen[id(self)]
+  def parts(self):
+    return []
+
 
 # AT class represent atomic propositions.
 # __repr__ handles two kinds of atomic propositions:
 #   string          Represented as is
 #   (string,number) Represented in the form string@number
 
-class AT:
+class AT(Formula):
   def __init__(self,name):
     self.name = name
   def __repr__(self):
@@ -44,7 +77,9 @@ class AT:
     return {self.name}
   def atommap(self,M):
     return M(self.name)
-  def makeBDD(self,bdd):
+  def structure(self,numbers):
+    return ("AT",self.name)
+  def buildBDD(self,bdd,bdds):
     return bdd.var(self.name)
 
 # Both CONJ and DISJ will inherit __init__ and vars from NaryFormula
@@ -54,12 +89,16 @@ class AT:
 # Because of associativity, ie. A & (B & C) and (A & B) & C are equivalent,
 # it is often more convenient to write A & B & C.
 
-class NaryFormula: # N-ary formulas with multiple subformulas
+class NaryFormula(Formula): # N-ary formulas with multiple subformulas
   def __init__(self,subformulas):
     self.subformulas = subformulas
   def vars(self):
     vs = [ f.vars() for f in self.subformulas ]
     return set.union(*vs)
+  def parts(self):
+    return self.subformulas
+  def structure(self,numbers):
+    return (type(self).__name__,tuple(numbers))
 
 class CONJ(NaryFormula):
   def __repr__(self):
@@ -69,8 +108,8 @@ class CONJ(NaryFormula):
       return "(and " + (' '.join([ str(x) for x in self.subformulas])) + ")"
   def atommap(self,M):
     return CONJ([f.atommap(M) for f in self.subformulas])
-  def makeBDD(self,bdd):
-    return applyforlist('and',self.subformulas,bdd,bdd.true)
+  def buildBDD(self,bdd,bdds):
+    return applyforlist('and',bdds,bdd,bdd.true)
 
 class DISJ(NaryFormula):
   def __repr__(self):
@@ -80,10 +119,10 @@ class DISJ(NaryFormula):
       return "(or " + (' '.join([ str(x) for x in self.subformulas])) + ")"
   def atommap(self,M):
     return DISJ([f.atommap(M) for f in self.subformulas])
-  def makeBDD(self,bdd):
-    return applyforlist('or',self.subformulas,bdd,bdd.false)
+  def buildBDD(self,bdd,bdds):
+    return applyforlist('or',bdds,bdd,bdd.false)
 
-class NEG:
+class NEG(Formula):
   def __init__(self,subformula):
     self.subformula = subformula
   def __repr__(self):
@@ -92,10 +131,14 @@ class NEG:
     return self.subformula.vars()
   def atommap(self,M):
     return NEG(self.subformula.atommap(M))
-  def makeBDD(self,bdd):
-    return ~ self.subformula.makeBDD(bdd)
-
-class TRUE:
+  def parts(self):
+    return [self.subformula]
+  def structure(self,numbers):
+    return ("NEG",numbers[0])
+  def buildBDD(self,bdd,bdds):
+    return ~ bdds[0]
+
+class TRUE(Formula):
   def __init__(self):
     self.name = "TRUE"
   def __repr__(self):
@@ -104,10 +147,12 @@ class TRUE:
     return set()
   def atommap(self,M):
     return self
-  def makeBDD(self,bdd):
+  def structure(self,numbers):
+    return ("TRUE",)
+  def buildBDD(self,bdd,bdds):
     return bdd.true
 
-class FALSE:
+class FALSE(Formula):
   def __init__(self):
     self.name = "FALSE"
   def __repr__(self):
@@ -116,7 +161,9 @@ class FALSE:
     return set()
   def atommap(self,M):
     return self
-  def makeBDD(self,bdd):
+  def structure(self,numbers):
+    return ("FALSE",)
+  def buildBDD(self,bdd,bdds):
     return bdd.false
 
 # Implication and equivalence reduced to the primitive connectives
@@ -0,0 +1,85 @@
+import time
+from dd import autoref as _bdd
+
+# Variable orderings for the BDDs in reachability analysis
+
+# State variables that interact: for every transition, the variables
+# in its condition and its effects, and the variables of the target.
+# Variables in the same group should be close to each other in the
+# ordering.
+
+def variablegroups(target,transitions):
+    groups = [ c.vars().union({ x for x,b in e }) for n,c,e in transitions ]
+    groups.append(target.vars())
+    return [ g for g in groups if len(g) > 1 ]
+
+# FORCE (Aloul, Markov and Sakallah 2003): each group is placed at the
+# center of gravity of its variables, each variable is moved to the
+# average center of gravity of its groups, and the variables are
+# sorted by their new positions. This is repeated while the total span
+# of the groups decreases. Returns the state variables in the order
+# found, starting from the alphabetical order.
+
+def forceorder(statevars,groups,maxiterations=50):
+    order = sorted(statevars)
+    occurrences = { v : [] for v in order }
+    for i,g in enumerate(groups):
+        for v in g:
+            occurrences[v].append(i)
+
+    def span(pos):
+        total = 0
+        for g in groups:
+            positions = [ pos[v] for v in g ]
+            total += max(positions) - min(positions)
+        return total
+
+    pos = { v : i for i,v in enumerate(order) }
+    bestorder = order
+    bestspan = span(pos)
+    for iteration in range(0,maxiterations):
+        cog = [ sum([ pos[v] for v in g ]) / len(g) for g in groups ]
+        newpos = { v : sum([ cog[i] for i in occurrences[v] ]) / len(occurrences[v]) if occurrences[v] else pos[v] for v in order }
+        order = sorted(order,key=lambda v : (newpos[v],v))
+        pos = { v : i for i,v in enumerate(order) }
+        s = span(pos)
+        if s >= bestspan:
+            break
+        bestorder = order
+        bestspan = s
+    return bestorder
+
+# Dynamic reordering that keeps every pair of a current and a next
+# state variable next to each other, as needed by the image operations.
+# Each pair, in the current order, is moved through all positions, and
+# left where the BDDs were smallest (sifting of pairs). Stops when
+# 'budget' seconds have been used. Returns the number of nodes after
+# reordering.
+
+def siftpairs(bdd,pairs,budget):
+    start = time.time()
+
+    def size():
+        bdd.collect_garbage()
+        return len(bdd)
+
+    def deploy(order):
+        _bdd.reorder(bdd,{ v : level for level,v in enumerate([ v for pair in order for v in pair ]) })
+
+    order = sorted(pairs,key=lambda pair : bdd.level_of_var(pair[0]))
+    best = size()
+    for pair in list(order):
+        if time.time() - start > budget:
+            break
+        rest = [ p for p in order if p != pair ]
+        for position in range(0,len(order)):
+            if time.time() - start > budget:
+                break
+            trial = rest[:position] + [pair] + rest[position:]
+            deploy(trial)
+            s = size()
+            if s < best:
+                best = s
+                order = trial
+        deploy(order)
+    return size()
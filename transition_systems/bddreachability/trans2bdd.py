@@ -0,0 +1,38 @@
+from logic import *
+
+# Direct construction of the BDD for a grounded transition, without
+# first building the formula of transition2logic in model2logic.py.
+#
+# The names of the BDD variables for the current and the next value
+# of a state variable x are current(x) and next(x).
+
+# Identity relation: x <-> x' for every state variable x.
+# Built from the last variable in the ordering upwards, so that each
+# conjunction only adds nodes on top of the BDD built so far.
+
+def identityrelation(bdd,statevars,current,next):
+    identity = bdd.true
+    for x in sorted(statevars,key=lambda x : bdd.level_of_var(current(x)),reverse=True):
+        identity = bdd.apply('and',bdd.apply('equiv',bdd.var(current(x)),bdd.var(next(x))),identity)
+    return identity
+
+# BDD for one transition: the condition, the effects as a cube of
+# literals for the next values, and the frame axioms x <-> x' for the
+# variables not changed by the effects. The frame axioms are obtained
+# from the identity relation by quantifying the changed variables away.
+# Effects that assign both values to a variable make the transition
+# impossible, as in transition2logic. 'cache' is passed to makeBDD for
+# the condition (see logic.py), so that conditions shared by several
+# transitions are translated once.
+
+def transition2bdd(bdd,transition,identity,current,next,cache=None):
+    actionname,condition,effect = transition
+    values = dict()
+    for x,b in effect:
+        if values.get(x,b) != b:
+            return bdd.false
+        values[x] = b
+    frame = bdd.exist([ current(x) for x in values ] + [ next(x) for x in values ],identity)
+    effectbdd = bdd.cube({ next(x) : b == 1 for x,b in values.items() })
+    conditionbdd = condition.atommap(lambda x : AT(current(x))).makeBDD(bdd,cache)
+    return bdd.apply('and',conditionbdd,bdd.apply('and',effectbdd,frame))